@@ -9,21 +9,437 @@ import os
 import unittest
 import residential
 import feeder
+import climate
+import data
+import stats
 import cPickle
+import shutil
+import tempfile
+import threading
 
-DIR = os.path.dirname(os.path.realpath(__file__))
-os.chdir(os.path.dirname(DIR)+'\\Data')
+import numpy as np
+
+class DataTest(unittest.TestCase):
+    '''
+    Testing the dataset registry.
+    '''
+
+    def setUp(self):
+        data.clear_registry()
+
+    def test_registry(self):
+        occ = data.get_occupancy(1)
+        self.assertTrue(data.get_occupancy(1) is occ)
+        self.assertEqual(occ['os'].shape, (3, 48, 3))
+        self.assertEqual(occ['ol'].shape, (3, 48, 144))
+        self.assertFalse(occ['ol'].flags.writeable)
+        info = data.registry_info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['hits'], 1)
+
+    def test_actDict(self):
+        act = data.get_actDict(2)
+        self.assertEqual(len(act['tv']), 144)
+        self.assertEqual(data.registry_info()['act'], [2])
+
+    def test_bundle(self):
+        path = data.compile_bundle(os.path.join(tempfile.mkdtemp(), 'test.npz'))
+        content = data._read_bundle(path)
+        self.assertEqual(int(content['__version__']), data.BUNDLE_VERSION)
+        self.assertEqual(content['occ_ol'].shape, (7, 3, 48, 144))
+        self.assertTrue(data.get_households()[1])
+
+    def test_bundle_replace(self):
+        path = data.compile_bundle(os.path.join(tempfile.mkdtemp(), 'test.npz'))
+        rename = os.rename
+        def windows(source, target):
+            # windows does not replace existing files
+            if os.path.exists(target):
+                raise OSError('File exists')
+            rename(source, target)
+        version = data.BUNDLE_VERSION
+        bundle = dict(data.get_bundle())
+        try:
+            os.rename = windows
+            data.BUNDLE_VERSION = version + 1
+            self.assertTrue(data._read_bundle(path) is None)
+            content = data._read_bundle(data.compile_bundle(path))
+            self.assertEqual(int(content['__version__']), version + 1)
+            self.assertTrue(isinstance(data._map_tables(path, content)['act_1'], np.memmap))
+            # and the bundle is kept in memory if it cannot be replaced at all
+            def busy(source, target):
+                raise OSError('File in use')
+            os.rename = busy
+            data.BUNDLE_VERSION = version + 2
+            data._BUNDLE.clear()
+            data._load_bundle(path)
+            self.assertEqual(data._BUNDLE['act_1'].shape, (144, 10))
+        finally:
+            os.rename = rename
+            data.BUNDLE_VERSION = version
+            data._BUNDLE.clear()
+            data._BUNDLE.update(bundle)
+
+    def test_mmap(self):
+        path = data.compile_bundle(os.path.join(tempfile.mkdtemp(), 'test.npz'))
+        content = data._map_tables(path, data._read_bundle(path))
+        self.assertTrue(isinstance(content['act_1'], np.memmap))
+        self.assertEqual(content['act_1'].shape, (144, 10))
+        # as are the normalized occupancy distributions of all patterns
+        self.assertTrue(isinstance(content['occ_ol'], np.memmap))
+
+    def test_compositions(self):
+        offsets, codes = data.sample_compositions(1000)
+        self.assertEqual(len(offsets), 1001)
+        self.assertEqual(len(codes), offsets[-1])
+        households = data.get_households()
+        offsets, codes = data.get_compositions()
+        members = data.decode_compositions(offsets, codes)
+        self.assertEqual(members[0], households[1])
+        self.assertEqual(members[-1], households[len(households)])
+
+    def test_clusters(self):
+        clusters = data.get_clusters_batch(['FTE', 'Retired', 'School'] * 1000)
+        self.assertEqual(clusters.shape, (3000, 3))
+        self.assertTrue(clusters.min() >= 1 and clusters.max() <= 6)
+        # the same distribution as a linear scan with get_probability
+        prob = data.get_bundle()['cross_Crosstable_Employment_wkdy'].T[1][1:]
+        rnd = np.random.random(100)
+        found = [stats.get_probability(r, prob, p_type='prob') for r in rnd]
+        cdf = data._cluster_cdf()[0, 1]
+        self.assertEqual(found, list(np.searchsorted(cdf, rnd, side='right') + 1))
+
+    def test_cdf(self):
+        occ = data.get_occupancy(4)
+        self.assertTrue(np.all(occ['ol'][..., -1] == 1))
+        self.assertTrue(np.all(np.diff(occ['os'], axis=-1) >= 0))
+        self.assertEqual(list(stats.get_cdf([1, 1, 2], p_type='prob')), [0.25, 0.5, 1])
+        self.assertRaises(ValueError, stats.get_cdf, [0.2, 0.1, 1.0])
+        self.assertRaises(ValueError, stats.get_cdf, [0.2, 0.5])
+        self.assertRaises(ValueError, stats.get_cdf, [0.3, 0.9, 1.7])
+        self.assertEqual(list(stats.get_cdf([0.5, 1 + 1e-9])), [0.5 / (1 + 1e-9), 1])
+        self.assertRaises(ValueError, stats.get_cdf, [0, 0, 0], p_type='prob')
+
+    def test_tensor(self):
+        tensor = data.get_activity_tensor(1, 2, 3)
+        self.assertEqual(tensor.shape, (7, 10, 144))
+        self.assertTrue(data.get_activity_tensor(1, 2, 3) is tensor)
+        self.assertTrue(np.array_equal(tensor[5, 4], data.get_actDict(2)['tv']))
+        self.assertTrue(np.array_equal(tensor[6, 4], data.get_actDict(3)['tv']))
+        dtmc = stats.DTMC(clusterDict={'wkdy': 1, 'sat': 2, 'son': 3})
+        self.assertTrue(dtmc.ds is tensor)
+        self.assertEqual(dtmc.get_var(0, 'tv', 10), data.get_actDict(1)['tv'][10])
+        for wkdy in range(1, 8):
+            for sat in range(1, 8):
+                data.get_activity_tensor(wkdy, sat, 3)
+                data.get_activity_tensor(wkdy, sat, 4)
+        self.assertEqual(len(data.registry_info()['tensors']), data.TENSOR_SIZE)
+
+    def test_threads(self):
+        cdir = os.getcwd()
+        clusters = []
+        def run():
+            clusters.append(data.get_clusters('FTE'))
+            data.get_occDict(clusters[-1]['wkdy'])
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(clusters), 8)
+        self.assertEqual(os.getcwd(), cdir)
+
+class StatsTest(unittest.TestCase):
+    '''
+    Testing the sampling functions.
+    '''
+
+    def test_probabilities(self):
+        prob = np.array([0.1, 0.1, 0.5, 1.0])
+        rnd = np.array([0.0, 0.05, 0.1, 0.3, 0.5, 0.99])
+        self.assertEqual(list(stats.get_probabilities(rnd, prob)), [1, 1, 3, 3, 4, 4])
+        self.assertEqual(stats.get_probability(0.3, prob), 3)
+        rows = data.get_occupancy(1)['ol'][0, :6]
+        found = stats.get_probabilities(rnd, rows)
+        for i in range(6):
+            self.assertEqual(found[i], stats.get_probability(rnd[i], rows[i]))
+
+    def test_alias(self):
+        alias = stats.Alias([0.04, 0.16, 0.35, 0.08, 0.11, 0.05, 0.20])
+        found = np.bincount(alias.draw(100000), minlength=8)[1:] / 100000.
+        self.assertTrue(np.allclose(found, [0.04, 0.16, 0.35, 0.08, 0.11, 0.05, 0.20], atol=0.01))
+        self.assertTrue(alias.draw() in range(1, 8))
+
+    def test_mcsa(self):
+        SA = stats.MCSA(3)
+        self.assertEqual(SA.ODM.shape, (3, 48, 144))
+        self.assertTrue(SA.transition(1, 12) in (1, 2, 3))
+        state = SA.startstate(100)
+        self.assertEqual(state.shape, (100,))
+        dt = SA.duration(state, np.arange(100) % 48 + 1)
+        self.assertTrue(dt.min() >= 1 and dt.max() <= 144)
+
+    def test_rng(self):
+        rnd = stats.get_rng(7, 1, 2).uniform(size=10)
+        self.assertTrue(np.array_equal(stats.get_rng(7, 1, 2).uniform(size=10), rnd))
+        self.assertFalse(np.array_equal(stats.get_rng(7, 2, 1).uniform(size=10), rnd))
+        self.assertFalse(np.array_equal(stats.get_rng(8, 1, 2).uniform(size=10), rnd))
+
+    def test_rle(self):
+        chains = np.array([[1, 1, 2, 2, 2, 3], [3, 3, 3, 3, 1, 1]])
+        starts, lengths, values = stats.rle(chains)
+        self.assertEqual(list(starts), [0, 2, 5, 6, 10])
+        self.assertEqual(list(lengths), [2, 3, 1, 4, 2])
+        self.assertEqual(list(values), [1, 2, 3, 3, 1])
+        self.assertTrue(np.array_equal(stats.rld(lengths, values, chains.shape), chains))
+
+    def test_sample_days(self):
+        stats.acceptance_info(reset=True)
+        start = 2 * np.ones(500, dtype=int)
+        clusters = np.ones(500, dtype=int)
+        check = lambda occs: occs[:, 72] == 1
+        occs = stats.sample_days(start, clusters, check, np.random.RandomState(1))
+        self.assertEqual(occs.shape, (500, 144))
+        info = stats.acceptance_info()
+        self.assertTrue(0 < info['rate'] < 1)
+        # a single day is drawn for each chain, and a batch for each rejected
+        self.assertEqual((info['drawn'] - 500) % stats.CANDIDATES, 0)
+        self.assertTrue(np.mean(check(occs)) > info['rate'])
+        again = stats.sample_days(start, clusters, check, np.random.RandomState(1))
+        self.assertTrue(np.array_equal(occs, again))
+
+    def test_simulate_days(self):
+        clusters = np.repeat([1, 5], 1000)
+        start = 2 * np.ones(2000, dtype=int)
+        occs = stats.simulate_days(start, clusters)
+        self.assertEqual(occs.shape, (2000, 144))
+        self.assertTrue(np.all(occs[:, 0] == 2))
+        # with the same statistics as a sequential chain of the MCSA
+        SA = stats.MCSA(5)
+        t48 = np.repeat(np.arange(1, 49), 3)
+        ref = np.zeros((1000, 144), dtype=int)
+        for occ in ref:
+            occ[0] = 2
+            dt = SA.duration(2, t48[0])
+            for tbin in range(1, 144):
+                if dt == 0:
+                    occ[tbin] = SA.transition(occ[tbin - 1], t48[tbin])
+                    dt = SA.duration(occ[tbin], t48[tbin]) - 1
+                else:
+                    occ[tbin] = occ[tbin - 1]
+                    dt += -1
+        for state in (1, 2, 3):
+            diff = np.mean(occs[1000:] == state) - np.mean(ref == state)
+            self.assertTrue(abs(diff) < 0.02)
+
+def write_epw():
+    '''
+    Write an EPW file with 100 W/m2 from 12:00 till 13:00 each day of a year.
+    '''
+    path = os.path.join(tempfile.mkdtemp(), 'test.epw')
+    with open(path, 'w') as epw:
+        epw.write('header\n' * 8)
+        for hour in range(8760):
+            ghi = 100.0 * (hour % 24 == 12)
+            epw.write('2013,1,1,%s,0,?' % (hour % 24 + 1) + ',0' * 7 + ',%s' % ghi + ',0' * 20 + '\n')
+    return path
+
+class ClimateTest(unittest.TestCase):
+    '''
+    Testing the climate provider.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = write_epw()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(os.path.dirname(cls.path))
+        climate.clear()
+
+    def test_epw(self):
+        path = self.path
+        irr = climate.get_irradiance(path)
+        self.assertTrue(climate.get_irradiance(path) is irr)
+        self.assertEqual(len(irr), 525600)
+        # the hour from 12:00 till 13:00 is at minute 12.5*60 - 4*60 of a day
+        self.assertEqual(irr[510], 100.0)
+        self.assertEqual(climate.get_irradiance(path, resolution=10).shape, (52560,))
+        # a leap year continues periodically with the first day
+        irr = climate.get_irradiance(path, minutes=366 * 1440)
+        self.assertEqual(len(irr), 527040)
+        self.assertEqual(irr[525600 + 510], 100.0)
+
+    def test_series(self):
+        # a 1-minute series starting at midnight is used from 4:00 AM on
+        path = os.path.join(os.path.dirname(self.path), 'test.npy')
+        np.save(path, np.arange(525600.))
+        irr = climate.get_irradiance(path)
+        self.assertEqual(list(irr[:2]), [240, 241])
+        self.assertEqual(irr[-1], 239)
+        self.assertEqual(climate.get_irradiance(path, start=0)[0], 0)
+        # unlike the pickled series of Uccle, which starts at 4:00 AM
+        path = os.path.join(os.path.dirname(self.path), 'test.txt')
+        cPickle.dump(list(np.arange(525600.)), open(path, 'wb'))
+        self.assertEqual(climate.get_irradiance(path)[0], 0)
+
+    def test_missing(self):
+        path = os.path.join(os.path.dirname(self.path), 'missing.txt')
+        self.assertRaises(IOError, climate.get_irradiance, path)
 
 class EquipmentTest(unittest.TestCase):
     '''
     Testing the equipment class.
     '''
 
+    def test_catalog(self):
+        catalog = residential.get_catalog()
+        self.assertTrue(residential.get_catalog() is catalog)
+        self.assertEqual(catalog['Kettle'].cycle_power, 2000)
+        row = catalog.rows(['Kettle', 'TV1'])
+        self.assertEqual(list(row['cycle_power']), [2000, 124])
+        self.assertEqual(row['delay'][0], 0)
+        self.assertFalse(catalog.table.flags.writeable)
+        with self.assertRaises(AttributeError):
+            catalog['Kettle'].cycle_power = 0
+        with self.assertRaises(AttributeError):
+            del catalog['Kettle'].cal
+        self.assertEqual(catalog['Kettle'].cycle_power, 2000)
+
+    def test_switch_events(self):
+        start, n_on = stats.switch_events(np.zeros(10), np.ones(10), 2.5, 0)
+        self.assertEqual(list(start), [0, 4, 8])
+        self.assertEqual(list(n_on), [3, 3, 3])
+        start, n_on = stats.switch_events(np.zeros(10), np.ones(10), -1, 0)
+        self.assertEqual(list(start), range(10))
+
+    def test_stochastic_load(self):
+        tv = residential.get_catalog()['TV1']
+        occ = np.ones(144 * 7)
+        clusters = {'wkdy': 1, 'sat': 2, 'son': 3}
+        r_eq, n_eq = tv.simulate(7, range(7), clusters, occ, np.random.RandomState(1))
+        self.assertEqual(len(r_eq['P']), 7 * 1440 + 1)
+        self.assertEqual(np.sum(r_eq['P'] == tv.standby_power), n_eq)
+        self.assertTrue(n_eq > 0)
+        r_eq, n_eq = tv.simulate(7, range(7), clusters, 2 * occ, np.random.RandomState(1))
+        self.assertEqual(n_eq, 0)
+
+    def test_cycle_load(self):
+        fridge = residential.get_catalog()['Refrigerator']
+        r_eq, n_eq = fridge.simulate(2, None, None, None, np.random.RandomState(3))
+        # the same as stepping through the minutes after the same delay
+        left = np.random.RandomState(3).normal(fridge.delay, fridge.delay / 4)
+        P = np.zeros(2 * 1440 + 1)
+        for tl in range(len(P)):
+            if left <= 0:
+                left += fridge.cycle_length
+                P[tl] = fridge.cycle_power
+            else:
+                left += -1
+                P[tl] = fridge.standby_power
+        self.assertTrue(np.array_equal(r_eq['P'], P))
+        self.assertEqual(n_eq, np.sum(P == fridge.cycle_power))
+
+    def test_stochastic_flow(self):
+        clusters = {'wkdy': 1, 'sat': 2, 'son': 3}
+        dtmc = stats.DTMC(clusterDict=clusters)
+        occ = np.random.RandomState(0).randint(1, 4, size=144 * 7)
+        for name in ['shortFlow', 'mediumFlow', 'bathFlow', 'showerFlow']:
+            tap = residential.get_catalog()[name]
+            r_fl, n_fl = tap.simulate(7, range(7), clusters, occ, np.random.RandomState(2))
+            # the same as stepping through the minutes with the same stream
+            rng = np.random.RandomState(2)
+            rnd = rng.uniform(size=7 * 1440)
+            left = -1
+            n_ref = 0
+            flow = np.zeros(7 * 1440 + 1)
+            for tl in range(7 * 1440):
+                to = tl // 10
+                if left <= 0:
+                    prob = 1 if occ[to] == 1 else 0
+                    if tap.activity != 'Presence':
+                        prob = prob * dtmc.get_var(to // 144, tap.activity, to % 144)
+                    if rnd[tl] < prob * tap.cal:
+                        n_ref += 1
+                        left = rng.normal(tap.cycle_length, tap.cycle_length / 10)
+                        flow[tl] += tap.standby_flow
+                else:
+                    left += -1
+                    flow[tl] += tap.cycle_flow
+            self.assertTrue(np.array_equal(r_fl['mDHW'], flow))
+            self.assertEqual(n_fl, n_ref)
+            self.assertTrue(n_fl > 0)
+
+    def test_events(self):
+        events = residential.Events([0, 5, 8], [2, 3, 5], [10, 20, 30], 9, base=1)
+        self.assertEqual(list(events.rasterize()), [11, 11, 1, 1, 1, 21, 21, 21, 31, 31])
+        self.assertEqual(list(events.rasterize(5)), [5, 25])
+        total = events + events * 0.5
+        self.assertEqual(len(total), 6)
+        self.assertTrue(np.allclose(total.rasterize(), 1.5 * events.rasterize()))
+        tv = residential.get_catalog()['TV1']
+        occ = np.ones(144 * 7)
+        clusters = {'wkdy': 1, 'sat': 2, 'son': 3}
+        r_eq, n_eq = tv.simulate(7, range(7), clusters, occ, np.random.RandomState(1))
+        ev_eq, n_ev = tv.simulate(7, range(7), clusters, occ, np.random.RandomState(1), events=True)
+        self.assertEqual(n_ev, n_eq)
+        self.assertTrue(np.array_equal(ev_eq.rasterize(), r_eq['P']))
+
+    def test_grid(self):
+        clusters = {'wkdy': 1, 'sat': 2, 'son': 3}
+        occ = np.random.randint(1, 4, 144 * 7)
+        grid = stats.DTMC(clusterDict=clusters).get_grid(range(7), occ)
+        self.assertEqual(len(grid), 11)
+        self.assertTrue(np.array_equal(grid['Presence'], occ == 1))
+        self.assertEqual(grid['tv'][144 * 5 + 10], (occ[144 * 5 + 10] == 1) * data.get_actDict(2)['tv'][10])
+        for name in ['TV1', 'Hob', 'Fax']:
+            eq = residential.get_catalog()[name]
+            r_eq, n_eq = eq.simulate(7, range(7), clusters, occ, np.random.RandomState(1))
+            r_gr, n_gr = eq.simulate(7, range(7), clusters, occ, np.random.RandomState(1), grid=grid)
+            self.assertTrue(np.array_equal(r_eq['P'], r_gr['P']))
+
+    def test_simulate_appliances(self):
+        catalog = residential.get_catalog()
+        apps = ['TV1', 'Refrigerator', 'Kettle']
+        clusters = [{'wkdy': 1, 'sat': 2, 'son': 3}, {'wkdy': 4, 'sat': 4, 'son': 4}]
+        occs = [np.random.randint(1, 4, 144 * 7) for i in range(2)]
+        grids = [stats.DTMC(clusterDict=c).get_grid(range(7), o) for c, o in zip(clusters, occs)]
+        rngs = [np.random.RandomState(i) for i in range(6)]
+        P, QRad, QCon, n_apps = residential.simulate_appliances(catalog.rows(apps), grids, 7, rngs, block=4)
+        # the same as simulating each appliance for each member
+        power = np.zeros(7 * 1440 + 1)
+        radi = np.zeros(7 * 1440 + 1)
+        for j, app in enumerate(apps):
+            n_app = 0
+            for i in range(2):
+                r_app, n_appi = catalog[app].simulate(7, range(7), clusters[i], occs[i],
+                                                      np.random.RandomState(2 * j + i))
+                power += r_app['P']
+                radi += r_app['QRad']
+                n_app += n_appi
+            self.assertEqual(n_apps[j], n_app)
+        self.assertTrue(np.allclose(P, power))
+        self.assertTrue(np.allclose(QRad, radi))
+
 class HouseholdTest(unittest.TestCase):
     '''
     Testing the household class.
     '''
 
+    @classmethod
+    def setUpClass(cls):
+        cls.source = climate.SOURCE
+        if not os.path.exists(climate.SOURCE):
+            climate.SOURCE = write_epw()
+
+    @classmethod
+    def tearDownClass(cls):
+        if climate.SOURCE != cls.source:
+            shutil.rmtree(os.path.dirname(climate.SOURCE))
+            climate.SOURCE = cls.source
+        climate.clear()
+
     def setUp(self):
         self.name = 'Example'
 
@@ -49,6 +465,44 @@ class HouseholdTest(unittest.TestCase):
         self.assertTrue(len(test.occ)!=0)
         print '\n'
 
+    def test_occupancy_full_year(self):
+        test = residential.Household(self.name)
+        test.__chronology__(2013)
+        test.__occupancy__(full_year=True)
+        self.assertEqual(len(test.occ), len(test.clusters))
+        self.assertEqual(len(test.occ[0]), 365 * 144)
+        self.assertEqual(len(test.occ_m[0]), 365 * 144)
+        # the mondays of the year are no longer identical
+        days = test.occ[0].reshape(365, 144)
+        self.assertFalse(np.array_equal(days[6], days[13]) and np.array_equal(days[13], days[20]))
+
+    def test_acceptance(self):
+        stats.acceptance_info(reset=True)
+        test = residential.Household(self.name)
+        test.__chronology__(2013)
+        test.runs += 1
+        test.__occupancy__()
+        # no days are drawn in vain if all are accepted by the check
+        info = stats.acceptance_info()
+        self.assertEqual(info['drawn'], 3 * len(test.clusters))
+        self.assertEqual(info['rate'], 1.0)
+
+    def test_streams(self):
+        tests = [residential.Household(self.name, seed=1, index=i) for i in (3, 3, 4)]
+        for test in tests:
+            test.__chronology__(2013)
+            test.runs += 1
+            test.__occupancy__()
+        self.assertEqual(tests[0].members, tests[1].members)
+        self.assertEqual(tests[0].apps, tests[1].apps)
+        self.assertTrue(np.array_equal(tests[0].occ, tests[1].occ))
+        self.assertFalse(np.array_equal(tests[0].occ, tests[2].occ) and tests[0].apps == tests[2].apps)
+        # and the streams of households with an index of another length differ
+        single = residential.Household(self.name, seed=7, index=1)
+        cluster = residential.Household(self.name, seed=7, index=(1, 1, 2))
+        self.assertFalse(np.array_equal(single.get_rng(1, 2, 1, 1).uniform(size=10),
+                                        cluster.get_rng(1, 1).uniform(size=10)))
+
     def test_pickle(self):
         test = residential.Household('Example')
         test.simulate()
@@ -70,6 +524,29 @@ class FeederTest(unittest.TestCase):
         self.assertEqual(test.name, self.name)
         print '\n'
 
+    def test_receptacles(self):
+        catalog = residential.get_catalog()
+        households = [residential.Household(self.name, seed=1, index=i) for i in range(3)]
+        for hou in households:
+            hou.__chronology__(2013)
+            hou.runs += 1
+            hou.__occupancy__()
+        P, QRad, QCon = feeder.receptacles(households, 900)
+        self.assertEqual(P.shape, (3, 35040))
+        # the same as simulating all appliances of each household
+        for k, hou in enumerate(households):
+            counter = range(len(hou.clusters))
+            grids = [stats.DTMC(clusterDict=hou.clusters[i]).get_grid(hou.dow, hou.occ[i]) for i in counter]
+            rngs = [hou.get_rng(hou.runs, 2, catalog.index[app], i) for app in hou.apps for i in counter]
+            power = residential.simulate_appliances(catalog.rows(hou.apps), grids, hou.nday, rngs)[0]
+            self.assertTrue(np.allclose(P[k], np.mean(power[:35040 * 15].reshape(-1, 15), axis=1)))
+        # and the same as simulating type by type with the grids built per block
+        P2, QRad2, QCon2 = np.zeros((3, 3, 35040))
+        for name in set(app for hou in households for app in hou.apps):
+            residential.simulate_type(name, households, P2, QRad2, QCon2, 15, block=3)
+        self.assertTrue(np.allclose(P, P2))
+        self.assertTrue(np.allclose(QCon, QCon2))
+
         
 class CommunityTest(unittest.TestCase):
     '''
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Climate data required by the simulation of lighting loads, being the global
+horizontal irradiance at the time-step of the simulation.
+"""
+
+import cPickle
+import os
+import threading
+
+import numpy as np
+
+import data
+
+##############################################################################
+# All households in a feeder share the same weather, so the irradiance is
+# loaded and resampled only once per process and shared read-only. The
+# default source is the pickled 1-minute series for Uccle, Belgium, yet
+# the source can be set to a '.npy' series at 1-minute resolution, which is
+# memory-mapped, or to an hourly EPW or TMY-style file. All sources are
+# taken to start at midnight of the first of January and are used from
+# minute START on, being 4:00 AM at which the simulation starts, except for
+# the pickled series of Uccle which already starts at 4:00 AM.
+SOURCE = data.get_path('Climate', 'irradiance.txt')
+START = 240
+_CACHE = dict()
+_LOCK = threading.Lock()
+
+def read_hourly(path, column=None):
+    '''
+    Read the hourly global horizontal irradiance from an EPW file or from a
+    TMY-style text file with a value for each hour of the year in the given
+    column.
+    '''
+    if os.path.splitext(path)[1].lower() == '.epw':
+        # the EPW format has 8 lines of header and the global horizontal
+        # radiation in the 14th field of each hourly record
+        column = 13 if column is None else column
+        return np.loadtxt(path, float, delimiter=',', skiprows=8,
+                          usecols=(column,))
+    column = 0 if column is None else column
+    try:
+        return np.loadtxt(path, float, usecols=(column,))
+    except ValueError:
+        return np.loadtxt(path, float, delimiter=',', usecols=(column,))
+
+def resample(hourly, resolution=1, start=START, minutes=None):
+    '''
+    Resample an hourly series to a series at the given resolution in minutes
+    for the given number of minutes or the entire year, starting at minute
+    'start' of the year as does the simulation at 4:00 AM. Hourly values are
+    taken at the middle of their hour and interpolated linearly, continuing
+    periodically at the year end, e.g. for the last day of a leap year.
+    '''
+    hourly = np.asarray(hourly, dtype=float)
+    period = len(hourly) * 60
+    minutes = period if minutes is None else minutes
+    hours = 30 + 60 * np.arange(len(hourly))
+    steps = start + resolution * np.arange(minutes // resolution)
+    return np.interp(steps, hours, hourly, period=period)
+
+def load(path, resolution=1, column=None, minutes=None, start=None):
+    '''
+    Load the irradiance of the source at path at the given resolution in
+    minutes from a pickled '.txt' or a '.npy' 1-minute series, or from an
+    hourly EPW or TMY-style file, for which a '.txt' file requires a column,
+    for at least the given number of minutes if given, from minute 'start'
+    of the source on, being START if not given except for pickled series.
+    '''
+    if not os.path.exists(path):
+        raise IOError("No irradiance found at '%s'. Set climate.SOURCE to a "
+                      "1-minute series as pickled '.txt' or '.npy' file, or to "
+                      "an hourly EPW file, or place the pickled 1-minute series "
+                      "of Uccle at '%s'." % (path, data.get_path('Climate', 'irradiance.txt')))
+    ext = os.path.splitext(path)[1].lower()
+    pickled = ext == '.txt' and column is None
+    if start is None:
+        start = 0 if pickled else START
+    if ext == '.npy':
+        irr = np.load(path, mmap_mode='r')
+    elif pickled:
+        irr = np.asarray(cPickle.load(open(path, 'rb')), dtype=float)
+    else:
+        return resample(read_hourly(path, column), resolution, start, minutes)
+    if start != 0 or (minutes is not None and len(irr) < minutes):
+        # a series of a regular year continues periodically after its end,
+        # e.g. for the first hours of the next year or for a leap year
+        nmin = len(irr) if minutes is None else minutes
+        irr = np.take(irr, start + np.arange(nmin), mode='wrap')
+    if resolution != 1:
+        # average the 1-minute series over each step of the resolution
+        nstep = len(irr) // resolution
+        irr = np.mean(np.reshape(irr[:nstep * resolution], (nstep, resolution)), axis=1)
+    return irr
+
+def get_irradiance(path=None, resolution=1, column=None, minutes=None, start=None):
+    '''
+    Get the read-only irradiance at the given resolution in minutes from
+    the source at path, or from SOURCE if not given, for at least the given
+    number of minutes, e.g. of a leap year, from minute 'start' of the
+    source on as for load(). Each source is loaded only once per process.
+    '''
+    path = SOURCE if path is None else path
+    key = (os.path.abspath(path), resolution, column, minutes, start)
+    with _LOCK:
+        if key not in _CACHE:
+            _CACHE.update({key: data._readonly(load(path, resolution, column, minutes, start))})
+        return _CACHE[key]
+
+def clear():
+    '''
+    Empty the cache of loaded irradiance series.
+    '''
+    with _LOCK:
+        _CACHE.clear()
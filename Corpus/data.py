@@ -5,37 +5,505 @@ Created on Thu Feb 06 09:48:07 2014
 @author: Ruben Baetens
 """
 
+import ast
+import collections
+import hashlib
+import json
 import os
+import threading
+
 import numpy as np
+
 import stats
 
+##############################################################################
+# All data is resolved from the 'StROBe/Data' directory next to this package,
+# or from the directory set in the 'STROBE_DATA' environment variable, such
+# that the data is found independent of the current working directory, which
+# is never changed by the loaders as to allow simulations in parallel threads.
+DATA_PATH = os.environ.get('STROBE_DATA', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data'))
+_LOCK = threading.RLock()
+
+##############################################################################
+# The employment types of household members, of which the index is used as
+# member-type code in the compact encoding of the household compositions.
+MEMBER_TYPES = ['U12', 'FTE', 'PTE', 'Unemployed', 'Retired', 'School']
+
+##############################################################################
+# The activities of which the proclivity is given in the Aerts datasets, in
+# the order of the columns of the activity arrays.
+ACTIVITIES = ['pc', 'food', 'vacuum', 'iron', 'tv', 'audio', 'dishes',
+              'washing', 'drying', 'shower']
+
+##############################################################################
+# All text sources in 'StROBe/Data' are compiled into a single versioned
+# binary bundle, holding the md5-checksums of its sources such that it is
+# rebuilt automatically whenever one of the text files is changed. Next to
+# the bundle, all numeric tables are packed in a single flat array which is
+# memory-mapped read-only, such that parallel worker processes share the
+# physical memory pages of the same file instead of each holding a copy. The
+# occupancy distributions are validated when compiling and stored as the
+# normalized cumulative distributions of all patterns stacked, of which the
+# registry hands out views only.
+BUNDLE_VERSION = 5
+BUNDLE_NAME = 'StROBe.npz'
+MMAP_MODE = 'r'
+_BUNDLE = dict()
+
+##############################################################################
+# The registry keeps the parsed Aerts datasets in memory for the lifetime of
+# the process, such that every pattern is parsed only once and the resulting
+# read-only arrays are shared by all households, members and appliances.
+_REGISTRY = {'occ': dict(), 'act': dict(), 'cdf': dict()}
+_COUNTER = {'hits': 0, 'misses': 0}
+
+##############################################################################
+# The activity tensors of the cluster triples (wkdy, sat, son) of household
+# members are shared as well, yet kept in a bounded least-recently-used cache
+# as there are up to 343 of such triples.
+TENSOR_SIZE = 64
+_TENSORS = collections.OrderedDict()
+
+def get_path(*parts):
+    '''
+    Get the absolute path of a file in the 'StROBe/Data' directory.
+    '''
+    return os.path.abspath(os.path.join(DATA_PATH, *parts))
+
+def _readonly(data):
+    '''
+    Flag the given array as read-only and return it.
+    '''
+    data.setflags(write=False)
+    return data
+
+def _loadtxt(path):
+    '''
+    Parse a whitespace or comma delimited text table into a float array.
+    '''
+    try:
+        return np.loadtxt(path, float)
+    except ValueError:
+        return np.loadtxt(path, float, delimiter=',')
+
+def _sources():
+    '''
+    List the bundle keys and relative paths of all text sources.
+    '''
+    sources = []
+    for cluster in range(1, 8):
+        pattern = 'Pattern' + str(cluster)
+        for key, name in [('ss', 'StartStates'), ('os', 'TransitionProbability'),
+                          ('ol', 'DurationProbability'), ('avg', 'AverageOccupancy')]:
+            sources.append(('occ_' + key + '_' + str(cluster),
+                            ('Aerts_Occupancy', pattern, name + '.txt')))
+        sources.append(('act_' + str(cluster),
+                        ('Aerts_Activities', pattern + '.txt')))
+        sources.append(('startact_' + str(cluster),
+                        ('Aerts_StartActivities', pattern + '.txt')))
+    for name in sorted(os.listdir(get_path('Aerts_Occupancy', 'Crosstables'))):
+        if name.endswith('.txt'):
+            sources.append(('cross_' + name[:-4],
+                            ('Aerts_Occupancy', 'Crosstables', name)))
+    sources.append(('appliances', ('Appliances.py',)))
+    sources.append(('households', ('Households.py',)))
+    return sources
+
+def _checksums():
+    '''
+    Get the md5-checksums of all text sources.
+    '''
+    checksums = dict()
+    for key, parts in _sources():
+        with open(get_path(*parts), 'rb') as source:
+            checksums.update({'/'.join(parts): hashlib.md5(source.read()).hexdigest()})
+    return checksums
+
+def _native(value):
+    '''
+    Convert the unicode strings returned by json to native strings.
+    '''
+    if isinstance(value, dict):
+        return dict((_native(k), _native(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [_native(v) for v in value]
+    elif not isinstance(value, str) and hasattr(value, 'encode'):
+        return str(value)
+    return value
+
+def _encode(households):
+    '''
+    Encode the household compositions as member-type codes 'hh_codes' of all
+    households in succession and the offsets 'hh_offsets' in hh_codes at
+    which each household starts, i.e. in compressed sparse row format.
+    '''
+    keys = sorted(households.keys())
+    lengths = [len(households[key]) for key in keys]
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    codes = np.array([MEMBER_TYPES.index(member) for key in keys
+                      for member in households[key]], dtype=np.int8)
+    return {'hh_offsets': offsets, 'hh_codes': codes}
+
+def _compile():
+    '''
+    Parse all text sources into a dictionary of arrays for the bundle.
+    '''
+    content = dict()
+    for key, parts in _sources():
+        if key in ('appliances', 'households'):
+            # the python dictionaries are stored as json strings, which are
+            # read far faster than evaluating the python literals.
+            dataset = ast.literal_eval(open(get_path(*parts)).read())
+            content.update({key: np.array(json.dumps(dataset, sort_keys=True))})
+            if key == 'households':
+                content.update(_encode(dataset))
+        else:
+            content.update({key: _loadtxt(get_path(*parts))})
+    content.update(_normalize(content))
+    content.update({'__version__': np.array(BUNDLE_VERSION),
+                    '__checksums__': np.array(json.dumps(_checksums(), sort_keys=True))})
+    return content
+
+def _normalize(content):
+    '''
+    Validate the occupancy and activity tables of all patterns in the parsed
+    content, replacing the occupancy tables by the cumulative distributions
+    of start states 'occ_ss' (7x3), transitions 'occ_os' (7x3x48x3) and
+    durations 'occ_ol' (7x3x48x144) of all patterns stacked.
+    '''
+    tables = {'ss': [], 'os': [], 'ol': []}
+    for cluster in range(1, 8):
+        key = str(cluster)
+        for kind, name, shape in [('ss', 'StartStates', (3,)),
+                                  ('os', 'TransitionProbability', (3, 48, 3)),
+                                  ('ol', 'DurationProbability', (3, 48, 144))]:
+            cdf = stats.get_cdf(content.pop('occ_' + kind + '_' + key), name + ' ' + key)
+            tables[kind].append(cdf.reshape(shape))
+        act = content['act_' + key]
+        if np.any(act < 0) or np.any(act > 1):
+            raise ValueError('Activity probabilities of pattern %s are not within [0, 1]' % key)
+    return dict(('occ_' + kind, np.array(value)) for kind, value in tables.items())
+
+def _tables(path):
+    '''
+    Get the path of the flat numeric tables next to the bundle at path.
+    '''
+    return os.path.splitext(path)[0] + '.npy'
+
+def _save(path, save, data):
+    '''
+    Save data to path through a temporary file, such that processes reading
+    the same path never see a partially written file.
+    '''
+    temp = path + '.' + str(os.getpid())
+    with open(temp, 'wb') as target:
+        save(target, data)
+    try:
+        os.rename(temp, path)
+    except OSError:
+        # windows does not replace existing files, so we remove the outdated
+        # file first, unless it is in use or replaced by another process
+        try:
+            os.remove(path)
+            os.rename(temp, path)
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+def compile_bundle(path=None):
+    '''
+    Compile all text sources in 'StROBe/Data' into a single binary bundle,
+    stored as 'StROBe/Data/StROBe.npz' if no other path is given, and its
+    memory-mappable numeric tables as 'StROBe/Data/StROBe.npy'.
+    '''
+    path = get_path(BUNDLE_NAME) if path is None else path
+    content = _compile()
+    # the layout holds offset and shape of each table in the flat array
+    layout = dict()
+    tables = []
+    offset = 0
+    for key in sorted(content.keys()):
+        if content[key].dtype.kind == 'f':
+            layout.update({key: [offset, list(content[key].shape)]})
+            tables.append(content[key].ravel())
+            offset += content[key].size
+    tables = np.concatenate(tables)
+    content.update({'__layout__': np.array(json.dumps(layout, sort_keys=True)),
+                    '__tables__': np.array(hashlib.md5(tables).hexdigest())})
+    _save(_tables(path), np.save, tables)
+    _save(path, lambda target, data: np.savez(target, **data), content)
+    return path
+
+def _read_bundle(path):
+    '''
+    Read the bundle at path if it is up to date with its sources, otherwise
+    return None.
+    '''
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as bundle:
+        content = dict((key, bundle[key]) for key in bundle.files)
+    if int(content.get('__version__', -1)) != BUNDLE_VERSION:
+        return None
+    if json.loads(str(content['__checksums__'])) != _checksums():
+        return None
+    return content
+
+def _map_tables(path, content):
+    '''
+    Replace the numeric tables in content by read-only views on the
+    memory-mapped flat array next to the bundle at path, if present.
+    '''
+    layout = json.loads(str(content['__layout__']))
+    size = sum(int(np.prod(shape)) for offset, shape in layout.values())
+    if not os.path.exists(_tables(path)):
+        return content
+    tables = np.load(_tables(path), mmap_mode=MMAP_MODE)
+    # the flat array may be outdated if it could not be replaced
+    if tables.shape != (size,) or hashlib.md5(tables).hexdigest() != str(content['__tables__']):
+        return content
+    for key, (offset, shape) in layout.items():
+        length = int(np.prod(shape))
+        content.update({str(key): tables[offset:offset + length].reshape(shape)})
+    return content
+
+def get_bundle(path=None):
+    '''
+    Get the content of the binary bundle, (re)compiling it first if missing
+    or outdated. The bundle is read only once per process and its numeric
+    tables are memory-mapped if MMAP_MODE is set.
+    '''
+    with _LOCK:
+        if not _BUNDLE:
+            _load_bundle(get_path(BUNDLE_NAME) if path is None else path)
+    return _BUNDLE
+
+def _load_bundle(path):
+    '''
+    Load the bundle at path into the process-wide bundle content.
+    '''
+    content = _read_bundle(path)
+    if content is None:
+        try:
+            content = _read_bundle(compile_bundle(path))
+        except (IOError, OSError):
+            content = None
+    if content is None:
+        # the data directory is read-only or the outdated bundle could not
+        # be replaced, so we keep it in memory
+        content = _compile()
+    if MMAP_MODE and '__layout__' in content:
+        content = _map_tables(path, content)
+    for key, value in content.items():
+        if key == 'appliances':
+            value = _native(json.loads(str(value)))
+        elif key == 'households':
+            value = _native(json.loads(str(value)))
+            value = dict((int(k), v) for k, v in value.items())
+        else:
+            value = _readonly(value)
+        _BUNDLE.update({key: value})
+
+def get_appliances():
+    '''
+    Get the appliance and tapping definitions of 'StROBe/Data/Appliances.py'.
+    '''
+    return get_bundle()['appliances']
+
+def get_households():
+    '''
+    Get the household compositions of 'StROBe/Data/Households.py'.
+    '''
+    return get_bundle()['households']
+
+def get_compositions():
+    '''
+    Get the household compositions as offsets and member-type codes in
+    compressed sparse row format, see MEMBER_TYPES for the codes.
+    '''
+    bundle = get_bundle()
+    return bundle['hh_offsets'], bundle['hh_codes']
+
+def sample_compositions(n, rng=np.random):
+    '''
+    Draw the compositions of n households at once from the equally likely
+    compositions in 'StROBe/Data/Households.py', returned as offsets and
+    member-type codes in compressed sparse row format.
+    '''
+    offsets, codes = get_compositions()
+    # draw the households and gather their rows of member-type codes
+    idx = (rng.uniform(size=n) * (len(offsets) - 1)).astype(int)
+    lengths = offsets[idx + 1] - offsets[idx]
+    new_offsets = np.zeros(n + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(lengths)
+    position = np.arange(new_offsets[-1]) + np.repeat(offsets[idx] - new_offsets[:-1], lengths)
+    return new_offsets, codes[position]
+
+def decode_compositions(offsets, codes):
+    '''
+    Decode compositions in compressed sparse row format to lists of
+    employment types.
+    '''
+    return [[MEMBER_TYPES[code] for code in codes[offsets[i]:offsets[i + 1]]]
+            for i in range(len(offsets) - 1)]
+
+def _load_occ(cluster):
+    '''
+    Get the occupancy arrays of the given pattern as views on the validated
+    cumulative distributions of start states 'ss' (3), transitions 'os'
+    (3x48x3) and durations 'ol' (3x48x144) in the bundle.
+    '''
+    tables = get_occupancy_tables()
+    return dict((key, tables[key][int(cluster) - 1]) for key in ['ss', 'os', 'ol'])
+
+def _load_act(cluster):
+    '''
+    Get the activity proclivity array of the given pattern from the bundle,
+    with a column for each of the 10 activities, validated when compiling.
+    '''
+    return get_bundle()['act_' + str(cluster)]
+
+def _lookup(kind, cluster, loader):
+    '''
+    Return the registered dataset of 'kind' for the given pattern, parsing
+    and registering it first if not yet present.
+    '''
+    cluster = int(cluster)
+    with _LOCK:
+        if cluster in _REGISTRY[kind]:
+            _COUNTER['hits'] += 1
+        else:
+            _COUNTER['misses'] += 1
+            _REGISTRY[kind][cluster] = loader(cluster)
+        return _REGISTRY[kind][cluster]
+
+def get_occupancy(cluster):
+    '''
+    Get the read-only occupancy arrays 'ss', 'os' and 'ol' of the given
+    pattern from the process-wide registry.
+    '''
+    return _lookup('occ', cluster, _load_occ)
+
+def get_activity(cluster):
+    '''
+    Get the read-only activity array (144x10) of the given pattern from the
+    process-wide registry.
+    '''
+    return _lookup('act', cluster, _load_act)
+
+def get_activity_tensor(wkdy, sat, son):
+    '''
+    Get the read-only activity tensor (7x10x144) of the given cluster triple,
+    holding the proclivity of each activity for each day of the week, from
+    the bounded cache shared by all members and appliances.
+    '''
+    key = (int(wkdy), int(sat), int(son))
+    with _LOCK:
+        if key in _TENSORS:
+            _COUNTER['hits'] += 1
+            tensor = _TENSORS.pop(key)
+        else:
+            _COUNTER['misses'] += 1
+            days = [key[0]] * 5 + [key[1], key[2]]
+            tensor = _readonly(np.array([get_activity(c).T for c in days]))
+            while len(_TENSORS) >= TENSOR_SIZE:
+                _TENSORS.popitem(last=False)
+        _TENSORS[key] = tensor
+        return tensor
+
+def get_occupancy_tables():
+    '''
+    Get the occupancy arrays of all 7 patterns stacked on a first axis, i.e.
+    start states 'ss' (7x3), transitions 'os' (7x3x48x3) and durations 'ol'
+    (7x3x48x144), for simulating chains of different patterns together, as
+    stored in the bundle.
+    '''
+    bundle = get_bundle()
+    return dict((key, bundle['occ_' + key]) for key in ['ss', 'os', 'ol'])
+
+def registry_info():
+    '''
+    Report the hit and miss counters of the registry and the patterns it
+    currently holds.
+    '''
+    with _LOCK:
+        info = dict(_COUNTER)
+        info.update({'occ': sorted(_REGISTRY['occ'].keys()),
+                     'act': sorted(_REGISTRY['act'].keys()),
+                     'tensors': list(_TENSORS.keys())})
+    return info
+
+def clear_registry():
+    '''
+    Empty the registry and reset its counters.
+    '''
+    with _LOCK:
+        for kind in _REGISTRY:
+            _REGISTRY[kind].clear()
+        _TENSORS.clear()
+        _COUNTER.update({'hits': 0, 'misses': 0})
+
+def _cluster_cdf():
+    '''
+    Get the cumulative distributions of the clusters for weekdays, saturday
+    and sunday (3) for each of the employment types (6) as an array of shape
+    (3x6x6), normalized once from the employment crosstables.
+    '''
+    with _LOCK:
+        if 'clusters' not in _REGISTRY['cdf']:
+            bundle = get_bundle()
+            cdf = np.zeros((3, len(MEMBER_TYPES), 6))
+            for i, key in enumerate(['wkdy', 'sat', 'son']):
+                # as before, the distribution is taken from the 2nd row on
+                prob = bundle['cross_Crosstable_Employment_'+key].T[:, 1:]
+                cdf[i] = stats.get_cdf(prob, 'Crosstable_Employment_'+key, 'prob')
+            _REGISTRY['cdf'].update({'clusters': _readonly(cdf)})
+        return _REGISTRY['cdf']['clusters']
+
+def _cluster_alias():
+    '''
+    Get the alias tables of the clusters for weekdays, saturday and sunday
+    (3) for each of the employment types (6), built once from _cluster_cdf().
+    '''
+    with _LOCK:
+        if 'alias' not in _REGISTRY['cdf']:
+            cdf = _cluster_cdf()
+            alias = [[stats.Alias(cdf[key, emp_i], 'cum') for emp_i in range(len(MEMBER_TYPES))]
+                     for key in range(3)]
+            _REGISTRY['cdf'].update({'alias': alias})
+        return _REGISTRY['cdf']['alias']
+
+def get_clusters_batch(employment, rng=np.random):
+    '''
+    Find the clusters for weekdays, saturday and sunday for all given
+    employment types or codes at once, returned as an integer array of shape
+    (n x 3) with the wkdy, sat and son cluster of every household member.
+    '''
+    employment = np.asarray(employment)
+    if employment.dtype.kind in ('S', 'U'):
+        employment = np.array([MEMBER_TYPES.index(str(emp)) for emp in employment])
+    employment = employment.astype(int).ravel()
+    alias = _cluster_alias()
+    clusters = np.zeros((len(employment), 3), dtype=int)
+    ##########################################################################
+    # we draw the clusters for each daytype and employment type at once from
+    # the alias tables of the crosstables
+    for emp_i in np.unique(employment):
+        members = employment == emp_i
+        for key in range(3):
+            clusters[members, key] = alias[key][emp_i].draw(np.sum(members), rng)
+    return clusters
+
 def get_clusters(employment, **kwargs):
     '''
     Find the clusters for weekdays, saturday and sunday for a household member
     of the given eployment type based on the Crosstables given at
     # http://homepages.vub.ac.be/~daerts/Occupancy.html
     '''
-    #first go the the correct location
-    cdir = os.getcwd()
-    PATH = os.path.abspath('Data\\Aerts_Occupancy\\Crosstables\\')
-    os.chdir(PATH)
-    #create an empty dictionary
-    keys = ['wkdy', 'sat', 'son']
-    cluDict = dict()
-    ##########################################################################
-    # we find the cluster for each of the daytypes for the given employment
-    # in 'Crosstable_employment.txt'
-    for key in keys:
-        order = ['U12','FTE','PTE','Unemployed','Retired','School']
-        emp_i = order.index(employment)
-        data = np.loadtxt('Crosstable_Employment_'+key+'.txt', float).T[emp_i]
-        rnd = np.random.random()
-        cluster = stats.get_probability(rnd, data[1:], p_type='prob')
-        cluDict.update({key:cluster})
-    ##########################################################################
-    # and return the final cluster id's
-    os.chdir(cdir)
-    return cluDict
+    clusters = get_clusters_batch([employment])[0]
+    return dict(zip(['wkdy', 'sat', 'son'], [int(c) for c in clusters]))
 
 def get_occDict(cluster, **kwargs):
     '''
@@ -43,43 +511,33 @@ def get_occDict(cluster, **kwargs):
     Aerts et al. as given at http://homepages.vub.ac.be/~daerts/Occupancy.html
     and stored in 'StROBe/Data/Aerts_Occupancy'.
     '''
-    #first go the the correct location
-    cdir = os.getcwd()
-    DATA_PATH = os.path.abspath('Data\\Aerts_Occupancy')
-    PATH = DATA_PATH + '\\Pattern' + str(cluster)
-    os.chdir(PATH)
+    # get the parsed arrays from the registry
+    data = get_occupancy(cluster)
     # create an empty dictionary
     occDict = dict()
     ##########################################################################
-    # first we load the occupancy start states 'oss' from StartStates.txt
-    ss = dict()    
-    data = np.loadtxt('StartStates.txt', float)
-    for i in range(len(data)):
-        ss.update({str(i+1):data[i]})
-    # and add the 'oss' data to the occupancy dictionary
+    # first we add the occupancy start states 'oss' from StartStates.txt
+    ss = dict()
+    for i in range(len(data['ss'])):
+        ss.update({str(i+1):data['ss'][i]})
     occDict.update({'ss':ss})
     ##########################################################################
-    # Second we load the occupancy transitions state probabilities 'osn' 
+    # Second we add the occupancy transitions state probabilities 'osn'
     # from TransitionProbability.txt
-    data = np.loadtxt('TransitionProbability.txt', float)
     for i in range(3):
         os_i = dict()
         for j in range(48):
-            os_i.update({str(j+1):data[i*48+j]})
-        # and add the 'osn_i' data to the occupancy dictionary
+            os_i.update({str(j+1):data['os'][i, j]})
         occDict.update({'os_'+str(i+1):os_i})
     ##########################################################################
-    # Third we load the Markov time density 'ol' from DurationProbability.txt
-    data = np.loadtxt('DurationProbability.txt', float)
+    # Third we add the Markov time density 'ol' from DurationProbability.txt
     for i in range(3):
         ol_i = dict()
         for j in range(48):
-            ol_i.update({str(j+1):data[i*48+j]})
-        # and add the 'osn_i' data to the occupancy dictionary
+            ol_i.update({str(j+1):data['ol'][i, j]})
         occDict.update({'ol_'+str(i+1):ol_i})
     ##########################################################################
     # and return the final occDict
-    os.chdir(cdir)
     return occDict
 
 def get_actDict(cluster, **kwargs):
@@ -88,25 +546,21 @@ def get_actDict(cluster, **kwargs):
     Aerts et al. as given at http://homepages.vub.ac.be/~daerts/Activity.html
     and stored in 'StROBe/Data/Aerts_activity'.
     '''
-    #first go the the correct location
-    cdir = os.getcwd()
-    DATA_PATH = os.path.abspath('Data\\Aerts_Activities')
-    os.chdir(DATA_PATH)
     # create an empty dictionary
     actDict = dict()
     ##########################################################################
     # first we define the dictionary used as legend for the load file
-    act = {0:'pc', 1:'food', 2:'vacuum', 3:'iron', 4:'tv', 5:'audio', 
-           6:'dishes', 7:'washing', 8:'drying', 9:'shower'}
+    act = dict(enumerate(ACTIVITIES))
     ##########################################################################
-    # Second we load the activity proclivity functions 'agn' 
-    # from Patter*cluster*.txt
-    FILNAM = 'Pattern'+str(cluster)+'.txt'
-    data = np.loadtxt(FILNAM, float)
+    # Second we get the activity proclivity functions 'agn' of
+    # Patter*cluster*.txt from the registry
+    data = get_activity(cluster)
     for i in range(10):
         actDict.update({act[i]:data.T[i]})
     ##########################################################################
     # and return the final actDict
     actDict.update({'period':600, 'steps':144})
-    os.chdir(cdir)
     return actDict
+
+if __name__ == '__main__':
+    print 'Compiled bundle %s' % compile_bundle()
@@ -7,6 +7,7 @@ Created on Mon Feb 24 11:39:35 2014
 
 from __future__ import division
 import residential
+import stats
 import cPickle
 import numpy as np
 import os
@@ -15,7 +16,7 @@ import os
 
 class IDEAS_cluster:
 
-    def __init__(self, bui_names, bui_numbers, path, sample_time, filter=False, test=False, extra_name=None):
+    def __init__(self, bui_names, bui_numbers, path, sample_time, filter=False, test=False, extra_name=None, seed=None, index=()):
         """
         Simulate clusters of buildings
 
@@ -26,20 +27,20 @@ class IDEAS_cluster:
         :param bool filter: If True, profiles with a constant comfort temperature are removed from the output
         :param bool test: if True, suppress simulations to reduce runtime. Default False.
         :param str extra_name: provide name with which to save summary files. Default None
+        :param int seed: seed of the random streams of all buildings. Default None, i.e. a new seed
+        :param tuple index: index of this set of clusters among others sharing the seed. Default ()
         """
         self.feeders = {}
         self.bui_numbers = bui_numbers
         self.buiNames = bui_names
-
-        cdir = os.getcwd()
+        self.path = path
+        seed = stats.new_seed() if seed is None else seed
 
         for i, name in enumerate(bui_names):
             nbui = bui_numbers[i]
             print '\n---- Cluster %s ----' % name
-            self.feeders[name] = IDEAS_Feeder(name=name, nBui=nbui, path=path, sample_time=sample_time, filter=filter, average=True, extra_name=True, cleanup=True, test=test)
-            os.chdir(cdir)
+            self.feeders[name] = IDEAS_Feeder(name=name, nBui=nbui, path=path, sample_time=sample_time, filter=filter, average=True, extra_name=True, cleanup=True, test=test, seed=seed, index=index + (i,))
 
-        os.chdir(path)
         print '---- Combining clusters now ----'
         self.output(extra_name)
 
@@ -74,7 +75,7 @@ class IDEAS_cluster:
             else:
                 filename = '{}.txt'.format(key)
 
-            np.savetxt(fname=filename, X=dat.T, header=hea, comments='')
+            np.savetxt(fname=os.path.join(self.path, filename), X=dat.T, header=hea, comments='')
 
 
 class IDEAS_Feeder(object):
@@ -82,7 +83,7 @@ class IDEAS_Feeder(object):
     The Community class defines a set of households.
     """
     
-    def __init__(self, name, nBui, path, sample_time, filter=False, average=False, extra_name=False, cleanup=False, test=False):
+    def __init__(self, name, nBui, path, sample_time, filter=False, average=False, extra_name=False, cleanup=False, test=False, seed=None, index=()):
         """
         Create the community based on number of households and simulate for
         output towards IDEAS model.
@@ -97,16 +98,20 @@ class IDEAS_Feeder(object):
         :param extra_name: If True, the name of the set of households is included in the name of output txt files
         :param cleanup: True if .p files should be removed
         :param test: True if simulation should not be run to make testing faster
+        :param seed: Seed of the random streams of all households, a new seed if None
+        :param index: Index of the feeder among others sharing the seed, as a tuple
         """
         self.name = name
         self.nBui = nBui
         self.bui = range(nBui)
+        self.path = path
+        self.seed = stats.new_seed() if seed is None else seed
+        self.index = index
         # we create, simulate and pickle all 'nBui' buildings
         if not test:
             self.simulate(path, filter)
         # then we loop through all variables and output as single file
         # for reading in IDEAS.mo
-        os.chdir(path)
         variables = ['P', 'Q', 'QRad', 'QCon', 'mDHW', 'sh_day', 'sh_bath', 'sh_night']
 
         if not test:
@@ -133,9 +138,8 @@ class IDEAS_Feeder(object):
         #######################################################################
         # we loop through all households for creation, simulation and pickling.
         # whereas the output is done later-on.
-        cwd = os.getcwd()
         for i in self.bui:
-            hou = residential.Household(str(self.name)+'_'+str(i))
+            hou = residential.Household(str(self.name)+'_'+str(i), seed=self.seed, index=self.index + (i,))
             if filter:
                 flag = False
                 while not flag:
@@ -146,9 +150,7 @@ class IDEAS_Feeder(object):
             else:
                 hou.simulate()
                 hou.roundUp()
-            os.chdir(path)
-            hou.pickle()
-            os.chdir(cwd)
+            hou.pickle(path)
 
     def output(self, variable, sample_time, extra_name=False):
         '''
@@ -161,7 +163,7 @@ class IDEAS_Feeder(object):
         print 'Output ' + variable
         dat = np.zeros(0)
         for i in self.bui:
-            hou = cPickle.load(open(str(self.name) + '_' + str(i) + '.p', 'rb'))
+            hou = cPickle.load(open(os.path.join(self.path, str(self.name) + '_' + str(i) + '.p'), 'rb'))
             var = eval('hou.' + variable)
             # If data is given every 10 minutes, repeat every 1 minute
             if len(var) == 52561:
@@ -199,12 +201,12 @@ class IDEAS_Feeder(object):
         else:
             name = variable
 
-        np.savetxt(fname=name+'.txt', X=new_dat.T, header=hea, comments='')
+        np.savetxt(fname=os.path.join(self.path, name+'.txt'), X=new_dat.T, header=hea, comments='')
 
     def create_average_building(self, variables):
         new_dat = {}
         for variable in variables:
-            dat = np.loadtxt(fname='{}_{}.txt'.format(variable, self.name),skiprows=2, unpack=True)
+            dat = np.loadtxt(fname=os.path.join(self.path, '{}_{}.txt'.format(variable, self.name)),skiprows=2, unpack=True)
             if not self.nBui == 1:
                 new_dat[variable] = np.mean(dat[1:], axis=0)
             else:
@@ -213,11 +215,53 @@ class IDEAS_Feeder(object):
 
     def cleanup(self):
         """
-        Clean all pickle files of this feeder from working directory
+        Clean all pickle files of this feeder from the output directory
 
         :return:
         """
-        filelist = [ f for f in os.listdir(".") if (f.endswith(".p") and f.startswith(str(self.name)))]
+        filelist = [ f for f in os.listdir(self.path) if (f.endswith(".p") and f.startswith(str(self.name)))]
         for f in filelist:
-            os.remove(f)
+            os.remove(os.path.join(self.path, f))
         print '   .p files removed.'
+
+
+def receptacles(households, sample_time=60, chunk=residential.BLOCK):
+    """
+    Simulate the receptacle loads of households of which the occupancy is simulated, appliance type by
+    appliance type for all owning households of a chunk of households at once.
+
+    :param households: list of residential.Household objects
+    :param int sample_time: sample time between data points. Should be an integer multiple of 60 sec.
+    :param int chunk: number of households of which the activity grids of the members are held at once
+    :return: arrays of P, QRad and QCon with a row for each household, starting at 4:00 AM
+    """
+    resolution = int(sample_time / 60)
+    nstep = (households[0].nday * 1440 + 1) // resolution
+    P = np.zeros((len(households), nstep))
+    QRad = np.zeros((len(households), nstep))
+    QCon = np.zeros((len(households), nstep))
+    catalog = residential.get_catalog()
+    for lo in range(0, len(households), chunk):
+        part = households[lo:lo + chunk]
+        # the activity grids of each member are shared by all appliance types
+        grids = [[stats.DTMC(clusterDict=hou.clusters[i]).get_grid(hou.dow[:hou.nday], hou.occ[i])
+                  for i in range(len(hou.clusters))] for hou in part]
+        found = dict((key, [np.zeros(0)]) for key in ['row', 'start', 'duration', 'P', 'QRad', 'QCon'])
+        base = np.zeros((3, len(part)))
+        for name in sorted(set(app for hou in part for app in hou.apps)):
+            eq = catalog[name]
+            owners, owner, events, count = residential.type_events(name, part, grids=grids)
+            found['row'].append(owners[owner])
+            found['start'].append(events.start)
+            found['duration'].append(events.duration)
+            for key, factor in zip(['P', 'QRad', 'QCon'], [1, eq.frad, eq.fconv]):
+                found[key].append(events.power * factor)
+            base[:, owners] += np.outer([1, eq.frad, eq.fconv], events.base.ravel())
+        # and the events of all types are rasterized at once for the chunk
+        found = dict((key, np.hstack(value)) for key, value in found.items())
+        for key, out, base_i in zip(['P', 'QRad', 'QCon'], [P, QRad, QCon], base):
+            events = residential.Events(found['start'], found['duration'], found[key],
+                                        part[0].nday * 1440, base_i[:, None])
+            events.rasterize(resolution, found['row'].astype(int), out[lo:lo + chunk])
+    return P, QRad, QCon
+
@@ -5,20 +5,24 @@ Created on Mon October 07 16:16:10 2013
 @author: Ruben Baetens
 """
 
-import ast
 import cPickle
 import calendar
 import datetime
 import itertools
 import os
-import random
+import threading
 import time
 
 import numpy as np
 
+import climate
 import data
 import stats
 
+# The alias table of the probabilities at which the space heating types 1 to
+# 7 occur based on Duth research, i.e. Leidelmeijer and van Grieken (2005).
+SH_TYPES = stats.Alias([0.04, 0.16, 0.35, 0.08, 0.11, 0.05, 0.20])
+
 
 class Household(object):
     '''
@@ -32,9 +36,12 @@ class Household(object):
         - self.simulate(), which ...
     '''
 
-    def __init__(self, name, **kwargs):
+    def __init__(self, name, seed=None, index=0, **kwargs):
         '''
-        Initiation of Household object.
+        Initiation of Household object, drawing all random numbers from
+        streams spawned from 'seed' by the household 'index' (an integer or a
+        tuple of integers), such that results are reproducible and
+        independent of the order or process in which households are made.
         '''
         # input ###############################################################
         # check on correct parameter input for use of functions as name should
@@ -47,13 +54,25 @@ class Household(object):
         # first define the name of the household object
         self.creation = time.asctime()
         self.name = name
+        self.seed = stats.new_seed() if seed is None else seed
+        self.index = index if isinstance(index, tuple) else (index,)
+        self.runs = 0
         self.parameterize()
 
+    def get_rng(self, *key):
+        '''
+        Get the random number generator of the stream 'key' of this household,
+        independent of all other streams and households, of which the index
+        is prefixed by its length as to separate it from the key.
+        '''
+        return stats.get_rng(self.seed, len(self.index), *(self.index + key))
+
     def parameterize(self, **kwargs):
         '''
         Get a household definition for occupants and present appliances based
         on average statistics or the given kwargs.
         '''
+        rng = self.get_rng(0)
 
         def members(**kwargs):
             '''
@@ -69,10 +88,8 @@ class Household(object):
                     raise TypeError('Given membertypes is no List of strings.')
             # If no types are given, random statististics are applied
             else:
-                dataset = ast.literal_eval(open(
-                    os.path.abspath('Data\\Households.py')).read())
-                key = random.randint(0, len(dataset))
-                members = dataset[key]
+                offsets, codes = data.sample_compositions(1, rng)
+                members = data.decode_compositions(offsets, codes)[0]
             # And return the members as list fo strings
             return members
 
@@ -81,16 +98,13 @@ class Household(object):
             Define the pressent household appliances based on average national
             statistics independent of household member composition.
             '''
-            # Loop through all appliances and pick randomly based on the 
-            # rate of ownership.
-            dataset = ast.literal_eval(open(os.path.abspath(
-                'Data\\Appliances.py')).read())
-            app_n = []
-            for app in dataset:
-                if dataset[app]['type'] == 'appliance':
-                    obj = Equipment(**dataset[app])
-                    owner = obj.owner <= random.random()
-                    app_n.append(app) if owner else None
+            # Pick all appliances at once randomly based on the rate of
+            # ownership in the catalog table.
+            catalog = get_catalog()
+            table = catalog.table
+            rnd = rng.uniform(size=len(table))
+            owner = (table['type'] == 'appliance') & (table['owner'] <= rnd)
+            app_n = [app for app, own in zip(catalog.names, owner) if own]
             return app_n
 
         def tappings():
@@ -106,11 +120,11 @@ class Household(object):
             members occupation in time use survey data.
             '''
             clusters = []
-            # loop for every individual in the household
-            for ind in members:
-                if ind != 'U12':
-                    clu_i = data.get_clusters(ind)
-                    clusters.append(clu_i)
+            # find the clusters of all individuals in the household at once
+            inds = [ind for ind in members if ind != 'U12']
+            for clu_i in data.get_clusters_batch(inds, rng):
+                clusters.append(dict(zip(['wkdy', 'sat', 'son'],
+                                         [int(c) for c in clu_i])))
             # and return the list of clusters
             return clusters
 
@@ -129,15 +143,18 @@ class Household(object):
 
         return None
 
-    def simulate(self, year=2013):
+    def simulate(self, year=2013, full_year=False):
         '''
         The simulate function includes the simulation of the household 
         occupancies, plug loads, lighting loads and hot water tappings.
+        If full_year, every day of the year is sampled independently
+        instead of repeating a typical week.
         '''
 
         self.year = year
+        self.runs += 1
         self.__chronology__(year)
-        self.__occupancy__()
+        self.__occupancy__(full_year=full_year)
         self.__plugload__()
         self.__dhwload__()
         self.__shsetting__()
@@ -159,89 +176,58 @@ class Household(object):
         self.nday = nday
         return None
 
-    def __occupancy__(self, min_form=True, min_time=False):
+    def __occupancy__(self, min_form=True, min_time=False, full_year=False):
         '''
         Simulation of a number of days based on cluster 'BxDict'.
         - Including weekend days,
-        - starting from a regular monday at 4:00 AM.
+        - starting from a regular monday at 4:00 AM,
+        - or for all days of the year independently if full_year.
         '''
 
-        def check(occday, min_form=True, min_time=False):
+        def check(occdays, min_form=True, min_time=False):
             '''
             We set a check which becomes True if the simulated day behaves 
             according to the cluster, as a safety measure for impossible
-            solutions.
+            solutions, for each of the given days 'occdays' at once.
             '''
 
             # script 1 ########################################################
             # First we check if the simulated occ-chain has the same shape
-            shape = True
-            if min_form:
-                location = np.zeros(1, dtype=int)
-                reduction = occday[0] * np.ones(1, dtype=int)
-                for i in range(len(occday) - 1):
-                    if occday[i + 1] != occday[i]:
-                        location = np.append(location, i + 1)
-                        reduction = np.append(reduction, occday[i + 1])
-                    #                shape = np.array_equal(reduction, RED)
+            occdays = np.atleast_2d(occdays)
+            shape = np.ones(len(occdays), dtype=bool)
+            #            if min_form:
+            #                shape = np.array_equal(reduction, RED)
 
             # script 2 ########################################################
             # And second we see if the chain has nu sub-30 min differences
-            length = True
+            length = np.ones(len(occdays), dtype=bool)
             if min_time:
-                minlength = 99
-                for i in location:
-                    j = 0
-                    while occday[i + j] == occday[i] and i + j < len(occday) - 1:
-                        j = j + 1
-                    if j < minlength:
-                        minlength = j
+                location, lengths, reduction = stats.rle(occdays)
+                row = location // occdays.shape[-1]
+                # where the last state of each day is counted one bin short
+                first = np.nonzero(np.append(True, np.diff(row) != 0))[0]
+                lengths[np.append(first[1:], len(row)) - 1] -= 1
+                minlength = np.minimum(99, np.minimum.reduceat(lengths, first))
                 # and we neglect the very short presences of 20 min or less
-                length = not minlength < 3
+                length = minlength >= 3
 
             # output ##########################################################
             # both have to be true to allow continuation, and we return boolean
-            return shape and length
+            return shape & length
 
-        def dayrun(start, cluster):
+        def dayrun(start, clusters):
             '''
-            Simulation of a single day according to start state 'start'
-            and the stochastics stored in cluster 'BxDict'and daytype 'Bx'.
+            Simulation of a single day for all household members at once
+            according to their start states 'start' and the stochastics
+            stored in their clusters 'clusters' of the daytype.
             '''
 
             # script ##########################################################
-            # we set the default daycheck at False for the first run and loop
-            # creating days while False, meaning while the simulated day does
-            # not correspond to the agreed-on rules in check().
-            daycheck = False
-            end = datetime.datetime.utcnow() + datetime.timedelta(seconds=10)
-            # defin the corresponding MCSA object from stats.py depicting a 
-            # Monte Carlo Survival Analysis object.
-            SA = stats.MCSA(cluster)
-            # and then keep simulating a day until True
-            while daycheck == False:
-                # set start state conditions
-                tbin = 0
-                occs = np.zeros(144, dtype=int)
-                occs[0] = start
-                t48 = np.array(sorted(list(range(1, 49)) * 3))
-                dt = SA.duration(start, t48[0])
-                # and loop sequentially transition and duration functions
-                while tbin < 143:
-                    tbin += 1
-                    if dt == 0:
-                        occs[tbin] = SA.transition(occs[tbin - 1], t48[tbin])
-                        dt = SA.duration(occs[tbin], t48[tbin]) - 1
-                        # -1 is necessary, as the occupancy state already started
-                    else:
-                        occs[tbin] = occs[tbin - 1]
-                        dt += -1
-                # whereafer we control if this day is ok
-                daycheck = check(occs)
-                # and we include a break if the while-loop takes to long until
-                # check()-conditions are fulfilled.
-                if datetime.datetime.utcnow() > end:
-                    break
+            # we simulate the day for all members in lockstep, drawing batches
+            # of candidate days for a bounded number of attempts and keeping
+            # the first day of each member for which check() is True,
+            # meaning the simulated day corresponds to the agreed-on rules.
+            occs = stats.sample_days(start, clusters, check, rng)
 
             # ouput ###########################################################
             # return occupants array if daycheck is ok according to Bx
@@ -253,57 +239,59 @@ class Household(object):
             profile denoting the most active state of all members.
             '''
             # scirpt ##########################################################
-            # We start defining an array of correct length filled with the 
-            # least active state and loop to see if more-active people are
-            # present at the depicted moment.
-            occs = int(3) * np.ones(len(occ[0]))
-            for member in occ:
-                for to in range(len(member)):
-                    if member[to] < occs[to]:
-                        occs[to] = member[to]
+            # We start from the least active state and take the most active
+            # state of all members at each moment.
+            occs = np.minimum(3.0, np.min(occ, axis=0))
 
             # ouput ###########################################################
             # return the merge occupancy states
             return occs
 
         # script ##############################################################
-        # We change the directory to to location where the data is stored,
-        # and run the three type of days, ie. wkdy, sat and son succesively
-        # by which we can create a typical week.
-        cdir = os.getcwd()
-        occ_week = []
-        for member in self.clusters:
-            startstate = 2  # 4.00 AM
-            wkdy = dayrun(startstate, member['wkdy'])
-            sat = dayrun(wkdy[-1], member['sat'])
-            son = dayrun(sat[-1], member['son'])
-            # and concatenate 
-            week = np.concatenate((np.tile(wkdy, 5), sat, son))
-            occ_week.append(week)
-        # A merge occupancy is created depicted the most active state of all
-        # household members, later-on used for set-point temperatures.
-        occ_merg = merge(occ_week)
-        # and combine the weekly occupancy states for the entire year by 
-        # repeating them every week and correcting for the first day of year,
-        # including for the merged occupancy.
-        bins = 144
-        tstart = bins * self.dow[0]
-        tstop = tstart + bins * self.nday
-        occ_year = []
-        for line in range(len(occ_week)):
-            occ_year.append(np.tile(occ_week, 54)[line][tstart:tstop])
-        occ_merged = []
-        occ_merged.append(np.tile(occ_merg, 54)[tstart:tstop])
+        rng = self.get_rng(self.runs, 1)
+        clusters = np.array([[member['wkdy'], member['sat'], member['son']]
+                             for member in self.clusters], dtype=int)
+        if full_year:
+            # We run all days of the year for all members at once, each day
+            # according to its type and starting from the start states at
+            # 4:00 AM, and merge them in the most active state of all members.
+            dow = np.array(self.dow)
+            daytype = np.where(dow < 5, 0, dow - 4)
+            clu = clusters[:, daytype].ravel()
+            days = dayrun(stats.startstates(clu, rng), clu)
+            occ_year = list(days.reshape(len(clusters), -1))
+            occ_merged = [merge(occ_year)]
+        else:
+            # We run the three type of days, ie. wkdy, sat and son
+            # succesively by which we can create a typical week.
+            startstate = 2 * np.ones(len(clusters), dtype=int)  # 4.00 AM
+            wkdy = dayrun(startstate, clusters[:, 0])
+            sat = dayrun(wkdy[:, -1], clusters[:, 1])
+            son = dayrun(sat[:, -1], clusters[:, 2])
+            # and concatenate
+            occ_week = list(np.hstack((np.tile(wkdy, (1, 5)), sat, son)))
+            # A merge occupancy is created depicted the most active state of
+            # all household members, later-on used for set-point temperatures.
+            occ_merg = merge(occ_week)
+            # and combine the weekly occupancy states for the entire year by
+            # repeating them every week and correcting for the first day of
+            # year, including for the merged occupancy.
+            bins = 144
+            tstart = bins * self.dow[0]
+            tstop = tstart + bins * self.nday
+            occ_year = []
+            for line in range(len(occ_week)):
+                occ_year.append(np.tile(occ_week, 54)[line][tstart:tstop])
+            occ_merged = []
+            occ_merged.append(np.tile(occ_merg, 54)[tstart:tstop])
 
         # output ##############################################################
-        # chdir back to original and return the occupancy states to the class
-        # object.
-        os.chdir(cdir)
+        # return the occupancy states to the class object.
         self.occ = occ_year
         self.occ_m = occ_merged
         # and print statements
-        presence = [to for to in self.occ_m[0] if to < 2]
-        hours = len(presence) / 6
+        presence = np.sum(self.occ_m[0] < 2)
+        hours = presence / 6
         print ' - Total presence time is %s out of 8760 hours' % str(hours)
         print '   (being %s percent)' % str(hours * 100 / 8760)
 
@@ -322,34 +310,23 @@ class Household(object):
             Simulation of the receptacle loads.
             '''
 
-            dataset = ast.literal_eval(open(os.path.abspath(
-                'Data\\Appliances.py')).read())
+            catalog = get_catalog()
             # define number of minutes
             nmin = self.nday * 1440
             # determine all transitions of the appliances depending on the appliance
-            # basic properties, ie. stochastic versus cycling power profile
-            power = np.zeros(nmin + 1)
-            radi = np.zeros(nmin + 1)
-            conv = np.zeros(nmin + 1)
+            # basic properties, ie. stochastic versus cycling power profile,
+            # for all appliances and household members at once
             nday = self.nday
             dow = self.dow
-            result_n = dict()
             counter = range(len(self.clusters))
-            for app in self.apps:
-                # create the equipment object with data from dataset.py
-                eq = Equipment(**dataset[app])
-                r_app = dict()
-                n_app = 0
-                # loop for all household mmembers
-                for i in counter:
-                    r_appi, n_appi = eq.simulate(nday, dow, self.clusters[i], self.occ[i])
-                    r_app = stats.sum_dict(r_app, r_appi)
-                    n_app += n_appi
-                # and sum
-                result_n.update({app: n_app})
-                power += r_app['P']
-                radi += r_app['QRad']
-                conv += r_app['QCon']
+            # the probabilities of the activities of each member are shared
+            # by all appliances
+            grids = [stats.DTMC(clusterDict=self.clusters[i]).get_grid(dow[:nday], self.occ[i])
+                     for i in counter]
+            rngs = [self.get_rng(self.runs, 2, catalog.index[app], i)
+                    for app in self.apps for i in counter]
+            power, radi, conv, n_apps = simulate_appliances(catalog.rows(self.apps), grids, nday, rngs)
+            result_n = dict(zip(self.apps, [int(n) for n in n_apps]))
             # a new time axis for power output is to be created as a different
             # time step is used in comparison to occupancy
             time = 4 * 60 * 600 + np.arange(0, (nmin + 1) * 60, 60)
@@ -379,11 +356,9 @@ class Household(object):
             # Simulation of lighting load requires information on irradiance
             # levels which determine the need for lighting if occupant.
             # The loaded solar data represent the global horizontal radiation
-            # at a time-step of 1-minute for Uccle, Belgium
-            file = open(os.path.abspath('Data\\Climate\\irradiance.txt'), 'r')
-            data_pickle = file.read()
-            file.close()
-            irr = cPickle.loads(data_pickle)
+            # at a time-step of 1-minute for Uccle, Belgium, and are shared
+            # by all households through the climate module.
+            irr = climate.get_irradiance(minutes=self.nday * 1440)
 
             # script ##########################################################
             # a yearly simulation is basic, also in a unittest
@@ -404,6 +379,7 @@ class Household(object):
             pow_adj = 40  # power by which is adjusted
             P = np.zeros(minutes + 1)
             Q = np.zeros(minutes + 1)
+            rnd = self.get_rng(self.runs, 3).uniform(size=minutes)
             for doy, step in itertools.product(range(nday), range(nbin)):
                 to += 1
                 for run in range(0, 10):
@@ -417,7 +393,7 @@ class Household(object):
                     # cycling power profile
                     if occ_m[to] == 0:
                         P[tl] = pow_id[tl]
-                    elif random.random() <= prob_adj:
+                    elif rnd[tl] <= prob_adj:
                         delta = P[tl - 1] - pow_id[tl]
                         delta_min = np.abs(delta - pow_adj)
                         delta_plus = np.abs(delta + pow_adj)
@@ -454,24 +430,27 @@ class Household(object):
         J.Widen (2009).
         '''
 
-        dataset = ast.literal_eval(open(os.path.abspath(
-            'Data\\Appliances.py')).read())
+        catalog = get_catalog()
         # define number of minutes
         nmin = self.nday * 1440
         # determine all transitions of the appliances depending on the appliance
         # basic properties, ie. stochastic versus cycling power profile
-        flow = np.zeros(nmin + 1)
+        flow = Events([], [], [], nmin)
         clusterDict = self.clusters[0]
         nday = self.nday
         dow = self.dow
         occ_m = self.occ_m[0]
+        grid = stats.DTMC(clusterDict=clusterDict).get_grid(dow[:nday], occ_m)
         result_n = dict()
         for tap in self.taps:
-            # create the equipment object with data from dataset.py
-            eq = Equipment(**dataset[tap])
-            r_tap, n_tap = eq.simulate(nday, dow, clusterDict, occ_m)
+            # get the equipment object from the catalog
+            eq = catalog[tap]
+            rng = self.get_rng(self.runs, 4, catalog.index[tap])
+            ev_tap, n_tap = eq.simulate(nday, dow, clusterDict, occ_m, rng,
+                                        events=True, grid=grid)
             result_n.update({tap: n_tap})
-            flow += r_tap['mDHW']
+            flow += ev_tap
+        flow = flow.rasterize()
         # a new time axis for power output is to be created as a different
         # time step is used in comparison to occupancy
         time = 4 * 60 * 600 + np.arange(0, (nmin + 1) * 60, 60)
@@ -510,9 +489,7 @@ class Household(object):
         types.update({'5': {1: 20.0, 2: 14.5, 3: 15.0}})
         types.update({'6': {1: 21.0, 2: 20.5, 3: 21.0}})
         types.update({'7': {1: 21.5, 2: 15.5, 3: 21.5}})
-        # and the probabilities these types occur based on Duth research,
-        # i.e. Leidelmeijer and van Grieken (2005).
-        types.update({'prob': [0.04, 0.16, 0.35, 0.08, 0.11, 0.05, 0.20]})
+        # of which the probabilities to occur are given in SH_TYPES,
         # and given a type, denote which rooms are heated
         given = dict()
         given.update({'1': [['dayzone', 'bathroom', 'nightzone']]})
@@ -525,12 +502,12 @@ class Household(object):
 
         #######################################################################
         # select a type from the given tipes and probabilities
-        rnd = np.random.random()
-        shtype = str(stats.get_probability(rnd, types['prob'], 'prob'))
+        rng = self.get_rng(self.runs, 5)
+        shtype = str(SH_TYPES.draw(rng=rng))
         # print '*** np.shape: {}'.format(np.shape(given[shtype]))
         # print given[shtype]
         if np.shape(given[shtype])[0] != 1:
-            nr = np.random.randint(np.shape(given[shtype])[0])
+            nr = int(rng.uniform() * np.shape(given[shtype])[0])
             # print 'multiple room settings recognized, chosen nr: {}'.format(nr)
             shrooms = given[shtype][nr]
         else:
@@ -605,11 +582,12 @@ class Household(object):
         # and end
         return flag
 
-    def pickle(self):
+    def pickle(self, path=''):
         '''
-        Pickle the generated profile and its results for storing later.
+        Pickle the generated profile and its results for storing later in
+        the directory 'path'.
         '''
-        cPickle.dump(self, open(self.name + '.p', 'wb'))
+        cPickle.dump(self, open(os.path.join(path, self.name + '.p'), 'wb'))
         return None
 
 
@@ -625,148 +603,371 @@ class Equipment(object):
         for (key, value) in kwargs.items():
             setattr(self, key, value)
 
-    def simulate(self, nday, dow, cluster, occ):
+    def __setattr__(self, key, value):
+        if self.__dict__.get('_frozen', False):
+            raise AttributeError('Equipment of the catalog is read-only')
+        object.__setattr__(self, key, value)
 
-        def stochastic_flow(self, nday, dow, clusterDict, occ):
-            '''
-            Simulate non-cycling appliances based on occupancy and the model 
-            and Markov state-space of Richardson et al.
-            '''
-            # parameters ######################################################
-            # First we check the required activity and load the respective
-            # stats.DTMC file with its data.
-            len_cycle = self.cycle_length
-            act = self.activity
-            if self.activity not in ('None', 'Presence'):
-                actdata = stats.DTMC(clusterDict=clusterDict)
-            else:
-                actdata = None
+    def __delattr__(self, key):
+        if self.__dict__.get('_frozen', False):
+            raise AttributeError('Equipment of the catalog is read-only')
+        object.__delattr__(self, key)
 
-            # script ##########################################################
-            # a yearly simulation is basic, also in a unittest
-            nbin = 144
-            minutes = nday * 1440
-            to = -1  # time counter for occupancy
-            tl = -1  # time counter for load
-            left = -1  # time counter for appliance duration
-            n_fl = 0
-            flow = np.zeros(minutes + 1)
-            for doy, step in itertools.product(range(nday), range(nbin)):
-                dow_i = dow[doy]
-                to += 1
-                for run in range(0, 10):
-                    tl += 1
-                    # check if this appliance is already on
-                    if left <= 0:
-                        # determine possibilities
-                        if self.activity == 'None':
-                            prob = 1
-                        elif self.activity == 'Presence':
-                            prob = 1 if occ[to] == 1 else 0
-                        else:
-                            occs = 1 if occ[to] == 1 else 0
-                            prob = occs * actdata.get_var(dow_i, act, step)
-                        # check if there is a statechange in the appliance
-                        if random.random() < prob * self.cal:
-                            n_fl += 1
-                            left = random.gauss(len_cycle, len_cycle / 10)
-                            flow[tl] += self.standby_flow
-                    else:
-                        left += -1
-                        flow[tl] += self.cycle_flow
+    def freeze(self):
+        '''
+        Make the equipment read-only, as are the prototypes of the Catalog
+        shared by all households.
+        '''
+        self.__dict__['_frozen'] = True
+        return self
 
-            r_fl = {'time': time, 'occ': None, 'P': None, 'Q': None, 'QRad': None,
-                    'QCon': None, 'Wknds': None, 'mDHW': flow}
+    def record(self, name=None):
+        '''
+        Get the equipment as a row of the structured array of the Catalog,
+        with its numeric fields being 0 if not defined.
+        '''
+        name = getattr(self, 'name', '') if name is None else name
+        table = np.zeros(1, dtype=Catalog.dtype)
+        table[0] = tuple([name, self.type, self.activity] +
+                         [getattr(self, field, 0) for field in Catalog.fields])
+        return table
 
-            return r_fl, n_fl
+    def simulate(self, nday, dow, cluster, occ, rng=np.random, events=False, grid=None):
+        '''
+        Simulate the equipment for 'nday' days, returning the dictionary of
+        its dense profiles, or its Events table if 'events', and the number of
+        times it was switched on. The probabilities of the activities can be
+        given as 'grid' of the DTMC of the member, shared by all equipment.
+        '''
 
-        def stochastic_load(self, nday, dow, clusterDict, occ):
-            '''
-            Simulate non-cycling appliances based on occupancy and the model 
-            and Markov state-space of Richardson et al.
-            '''
+        # parameters ##########################################################
+        # The probability of the required activity at each ten-minute step,
+        # which is not needed if independent of activity or cycling.
+        minutes = nday * 1440
+        prob = None
+        if self.activity != 'None' and getattr(self, 'delay', 0) == 0:
+            if grid is None:
+                actdata = stats.DTMC(clusterDict=cluster)
+                grid = actdata.get_grid(dow[:nday], occ, [self.activity])
+            prob = grid[self.activity]
 
-            # parameters ######################################################
-            # First we check the required activity and load the respective
-            # stats.DTMC file with its data.
-            len_cycle = self.cycle_length
-            act = self.activity
-            if self.activity not in ('None', 'Presence'):
-                actdata = stats.DTMC(clusterDict=clusterDict)
+        # script ##############################################################
+        # the equipment is simulated by the same kernel as all appliances of
+        # a household, for a single pair of equipment and member
+        start, duration, power, base, count = _activations(self.record(), [prob], [rng], minutes)
+        ev_app = Events(start[0], duration[0], power[0], minutes, base=base[0])
+        n_app = int(count[0])
+        if events:
+            return ev_app, n_app
+
+        # and rasterize the events into dense profiles if not asked for
+        if self.type == 'appliance':
+            P = ev_app.rasterize()
+            r_app = {'time': time, 'occ': None, 'P': P, 'Q': np.zeros(len(P)),
+                     'QRad': P * self.frad, 'QCon': P * self.fconv,
+                     'Wknds': None, 'mDHW': None}
+        else:
+            r_app = {'time': time, 'occ': None, 'P': None, 'Q': None, 'QRad': None,
+                     'QCon': None, 'Wknds': None, 'mDHW': ev_app.rasterize()}
+
+        return r_app, n_app
+
+
+class Events(object):
+    '''
+    The Events class holds the profile of equipment as a table of events,
+    each adding 'power' for 'duration' minutes from minute 'start' on top of
+    a constant 'base', over the 'minutes' + 1 minutes of the simulation, from
+    which dense profiles are only built on demand.
+    '''
+
+    def __init__(self, start, duration, power, minutes, base=0.0):
+        self.start = np.asarray(start, dtype=int)
+        self.duration = np.asarray(duration, dtype=int) * np.ones(len(self.start), dtype=int)
+        self.power = np.asarray(power, dtype=float) * np.ones(len(self.start))
+        self.minutes = minutes
+        self.base = base
+
+    def __len__(self):
+        return len(self.start)
+
+    def __add__(self, other):
+        if other.minutes != self.minutes:
+            raise ValueError('Events of %s and %s minutes cannot be added' % (self.minutes, other.minutes))
+        return Events(np.hstack((self.start, other.start)),
+                      np.hstack((self.duration, other.duration)),
+                      np.hstack((self.power, other.power)),
+                      self.minutes, self.base + other.base)
+
+    def __mul__(self, factor):
+        return Events(self.start, self.duration, self.power * factor,
+                      self.minutes, self.base * factor)
+
+    def rasterize(self, resolution=1, rows=None, out=None):
+        '''
+        Get the dense profile of the events at the given resolution in
+        minutes, averaged over each step of the resolution, or add the
+        profiles of the events of each row into the array 'out' (rows x
+        steps) if the row of each event is given as 'rows'.
+        '''
+        if rows is not None:
+            return self._accumulate(resolution, rows, out)
+        nstep = (self.minutes + 1) // resolution
+        # the minutes at which each of the events is present
+        duration = np.maximum(0, self.duration)
+        first = np.repeat(np.cumsum(duration) - duration, duration)
+        minute = np.repeat(self.start, duration) + np.arange(len(first)) - first
+        power = np.repeat(self.power, duration)
+        keep = minute < nstep * resolution
+        profile = np.bincount(minute[keep] // resolution, power[keep], minlength=nstep)
+        return self.base + profile / resolution
+
+    def _accumulate(self, resolution, rows, out):
+        # the events add their power at their start and remove it at their
+        # end in a difference array of each row, of which the cumulative sum
+        # is the profile, for a block of rows at a time
+        nstep = (self.minutes + 1) // resolution
+        if np.shape(out)[-1] != nstep:
+            raise ValueError('Output of %s steps instead of %s' % (np.shape(out)[-1], nstep))
+        length = nstep * resolution
+        rows = np.asarray(rows, dtype=int)
+        order = np.argsort(rows, kind='mergesort')
+        start = np.minimum(self.start, length)[order]
+        end = np.minimum(self.start + np.maximum(0, self.duration), length)[order]
+        power = self.power[order]
+        bounds = np.searchsorted(rows[order], np.arange(0, len(out) + BLOCK, BLOCK))
+        for b, lo in enumerate(range(0, len(out), BLOCK)):
+            nrow = min(BLOCK, len(out) - lo)
+            ev = slice(bounds[b], bounds[b + 1])
+            index = (rows[order][ev] - lo) * (length + 1)
+            diff = np.bincount(index + start[ev], power[ev], minlength=nrow * (length + 1))
+            diff -= np.bincount(index + end[ev], power[ev], minlength=nrow * (length + 1))
+            profile = np.cumsum(diff.reshape(nrow, length + 1)[:, :length], axis=1)
+            if resolution > 1:
+                profile = profile.reshape(nrow, nstep, resolution).sum(axis=2) / resolution
+            out[lo:lo + nrow] += profile
+        out += self.base
+        return out
+
+
+##############################################################################
+# The appliances are simulated for many pairs of appliance and member at
+# once, either for all appliances of a household or for one appliance of
+# all households, for which the switch-on candidates of a block of pairs are
+# found in a single pass over their matrix of probabilities.
+BLOCK = 8
+
+def _activations(table, probs, rngs, minutes, block=BLOCK):
+    '''
+    Find the events of the pairs of appliance and member given as a row of
+    the structured catalog array 'table' for each pair, with the activity
+    probability of the member at each ten-minute step in 'probs' (or None if
+    not used) and their random generators 'rngs'. Return the starts,
+    durations and power of the events of each pair, and its base power and
+    number of times switched on.
+    '''
+    start = [np.zeros(0, dtype=int)] * len(table)
+    duration = [np.zeros(0, dtype=int)] * len(table)
+    power = [np.zeros(0)] * len(table)
+    base = np.zeros(len(table))
+    count = np.zeros(len(table), dtype=int)
+    # the cycling appliances are switched on in closed form after a delay,
+    # and are at standby power otherwise
+    for r, app in enumerate(table):
+        if app['delay'] != 0:
+            delay = rngs[r].normal(app['delay'], app['delay'] // 4)
+            start[r] = stats.cycle_events(delay, app['cycle_length'], minutes)
+            duration[r] = np.ones(len(start[r]), dtype=int)
+            power[r] = (app['cycle_power'] - app['standby_power']) * np.ones(len(start[r]))
+            base[r] = app['standby_power']
+            count[r] = len(start[r])
+    # whereas the stochastic appliances and tapping points are switched on at
+    # the candidates of their minute uniforms below the probability of their
+    # ten-minute step, of which those within the dead-time of earlier events
+    # are skipped, being at standby power or flow at the minute of switching
+    # on and at cycle power or flow while running thereafter
+    stochastic = [r for r, app in enumerate(table) if app['delay'] == 0]
+    for b in range(0, len(stochastic), block):
+        batch = stochastic[b:b + block]
+        prob = np.ones((len(batch), minutes // 10))
+        for i, r in enumerate(batch):
+            if table[r]['activity'] != 'None':
+                prob[i] = probs[r]
+            prob[i] = prob[i] * table[r]['cal']
+        rnd = np.array([rngs[r].uniform(size=minutes) for r in batch])
+        hit = rnd.reshape(len(batch), -1, 10) < prob[:, :, None]
+        row, cand = np.nonzero(hit.reshape(len(batch), minutes))
+        bounds = np.searchsorted(row, np.arange(len(batch) + 1))
+        for i, r in enumerate(batch):
+            app = table[r]
+            on, n_on = stats.skip_events(cand[bounds[i]:bounds[i + 1]], app['cycle_length'],
+                                         app['cycle_length'] // 10, rngs[r])
+            n_on = np.maximum(0, np.minimum(on + 1 + n_on, minutes) - on - 1)
+            start[r] = np.hstack((on, on + 1))
+            duration[r] = np.hstack((np.ones(len(on), dtype=int), n_on))
+            if app['type'] == 'appliance':
+                standby, cycle = app['standby_power'], app['cycle_power']
             else:
-                actdata = None
+                standby, cycle = app['standby_flow'], app['cycle_flow']
+            power[r] = np.hstack((standby * np.ones(len(on)), cycle * np.ones(len(on))))
+            count[r] = len(on)
+    return start, duration, power, base, count
 
-            # script ##########################################################
-            # a yearly simulation is basic, also in a unittest
-            nbin = 144
-            minutes = nday * 1440
-            to = -1  # time counter for occupancy
-            tl = -1  # time counter for load
-            left = -1  # time counter for appliance duration
-            n_eq = 0
-            P = np.zeros(minutes + 1)
-            Q = np.zeros(minutes + 1)
-            for doy, step in itertools.product(range(nday), range(nbin)):
-                dow_i = dow[doy]
-                to += 1
-                for run in range(10):
-                    tl += 1
-                    # check if this appliance is already on
-                    if left <= 0:
-                        # determine possibilities
-                        if self.activity == 'None':
-                            prob = 1
-                        elif self.activity == 'Presence':
-                            prob = 1 if occ[to] == 1 else 0
-                        else:
-                            occs = 1 if occ[to] == 1 else 0
-                            prob = occs * actdata.get_var(dow_i, act, step)
-                        # check if there is a statechange in the appliance
-                        if random.random() < prob * self.cal:
-                            n_eq += 1
-                            left = random.gauss(len_cycle, len_cycle / 10)
-                            P[tl] += self.standby_power
-                    else:
-                        left += -1
-                        P[tl] += self.cycle_power
+def simulate_appliances(table, grids, nday, rngs, block=BLOCK):
+    '''
+    Simulate the appliances of the structured catalog array 'table' for all
+    members with the activity grids 'grids', of which the pairs of appliance
+    and member draw from the random generators 'rngs' appliance by appliance,
+    and return the summed P, QRad and QCon profiles and the number of times
+    each appliance was switched on.
+    '''
+    minutes = nday * 1440
+    app = np.repeat(np.arange(len(table)), len(grids))
+    probs = [grids[m].get(table[a]['activity']) for a in range(len(table))
+             for m in range(len(grids))]
+    start, duration, power, base, count = _activations(table[app], probs, rngs, minutes, block)
+    # and all events are reduced at once into the total profiles, with the
+    # heat fractions of the appliance of each event
+    frad = table['frad'][app]
+    fconv = table['fconv'][app]
+    n_ev = [len(on) for on in start]
+    start = np.hstack([np.zeros(0, dtype=int)] + start)
+    duration = np.hstack([np.zeros(0, dtype=int)] + duration)
+    power = np.hstack([np.zeros(0)] + power)
+    P = Events(start, duration, power, minutes, sum(base)).rasterize()
+    QRad = Events(start, duration, power * np.repeat(frad, n_ev), minutes,
+                  sum(base * frad)).rasterize()
+    QCon = Events(start, duration, power * np.repeat(fconv, n_ev), minutes,
+                  sum(base * fconv)).rasterize()
+    count = np.bincount(app, count, minlength=len(table)).astype(int)
+    return P, QRad, QCon, count
+
+def type_events(name, households, block=BLOCK, grids=None):
+    '''
+    Find the events of the appliance 'name' for all members of all owning
+    households of which the occupancy is simulated at once, block by block of
+    members drawing from the same streams as does the household itself. The
+    activity grids of the members of each household can be given as 'grids'
+    to share them between types, else they are built for each block. Return
+    the owning households, the owner of each event, the Events with the base
+    power of each owner and the number of times switched on for each owner.
+    '''
+    catalog = get_catalog()
+    eq = catalog[name]
+    nday = households[0].nday if households else 0
+    if any(hou.nday != nday for hou in households):
+        raise ValueError('Households of %s simulate a different number of days' % name)
+    minutes = nday * 1440
+    pairs = [(k, i) for k, hou in enumerate(households) if name in hou.apps
+             for i in range(len(hou.clusters))]
+    owners, owner = np.unique(np.array([k for k, i in pairs], dtype=int), return_inverse=True)
+    table = catalog.rows([name] * min(block, len(pairs)))
+    rows = [np.zeros(0, dtype=int)]
+    start = [np.zeros(0, dtype=int)]
+    duration = [np.zeros(0, dtype=int)]
+    power = [np.zeros(0)]
+    base = np.zeros(len(owners))
+    counts = np.zeros(len(owners), dtype=int)
+    for b in range(0, len(pairs), block):
+        batch = pairs[b:b + block]
+        rngs = [households[k].get_rng(households[k].runs, 2, catalog.index[name], i)
+                for k, i in batch]
+        # the probabilities are only held for the members of the block
+        probs = []
+        for k, i in batch:
+            if eq.activity == 'None' or eq.delay != 0:
+                probs.append(None)
+            elif grids is not None:
+                probs.append(grids[k][i][eq.activity])
+            else:
+                hou = households[k]
+                actdata = stats.DTMC(clusterDict=hou.clusters[i])
+                probs.append(actdata.get_grid(hou.dow[:nday], hou.occ[i], [eq.activity])[eq.activity])
+        on, dur, pow_on, base_on, count = _activations(table[:len(batch)], probs, rngs,
+                                                       minutes, block)
+        rows.append(np.repeat(owner[b:b + block], [len(x) for x in on]))
+        start.extend(on)
+        duration.extend(dur)
+        power.extend(pow_on)
+        base += np.bincount(owner[b:b + block], base_on, minlength=len(owners))
+        counts += np.bincount(owner[b:b + block], count, minlength=len(owners)).astype(int)
+    events = Events(np.hstack(start), np.hstack(duration), np.hstack(power), minutes,
+                    base[:, None])
+    return owners, np.hstack(rows), events, counts
+
+def simulate_type(name, households, P, QRad, QCon, resolution=1, block=BLOCK, grids=None):
+    '''
+    Simulate the appliance 'name' for all members of all owning households
+    of which the occupancy is simulated at once, and add their P, QRad and
+    QCon profiles at the given resolution in minutes into the preallocated
+    arrays with a row for each household, as found by type_events. Return
+    the number of times the appliance was switched on in each household.
+    '''
+    eq = get_catalog()[name]
+    owners, rows, events, count = type_events(name, households, block, grids)
+    # the events are rasterized for a block of owners at a time
+    for lo in range(0, len(owners), block):
+        sel = (rows >= lo) & (rows < lo + block)
+        part = Events(events.start[sel], events.duration[sel], events.power[sel],
+                      events.minutes, events.base[lo:lo + block])
+        profile = np.zeros((len(part.base), np.shape(P)[-1]))
+        part.rasterize(resolution, rows[sel] - lo, profile)
+        P[owners[lo:lo + block]] += profile
+        QRad[owners[lo:lo + block]] += profile * eq.frad
+        QCon[owners[lo:lo + block]] += profile * eq.fconv
+    counts = np.zeros(len(P), dtype=int)
+    counts[owners] = count
+    return counts
+
+
+class Catalog(object):
+    '''
+    The Catalog class holds the appliance and tapping definitions given in
+    'StROBe/Data/Appliances.py' as prebuilt Equipment prototypes, shared
+    read-only by all households, and as a structured array of their numeric
+    fields for use in vectorized computations.
+    '''
 
-            r_eq = {'time': time, 'occ': None, 'P': P, 'Q': Q, 'QRad': P * self.frad,
-                    'QCon': P * self.fconv, 'Wknds': None, 'mDHW': None}
+    # the numeric fields in the structured array, being 0 if not defined
+    fields = ['cal', 'cycle_power', 'standby_power', 'cycle_length', 'frad',
+              'fconv', 'owner', 'delay', 'cycle_flow', 'standby_flow']
 
-            return r_eq, n_eq
+    dtype = [('name', 'S16'), ('type', 'S16'), ('activity', 'S16')]
+    dtype += [(field, float) for field in fields]
 
-        def cycle_load(self, nday):
-            '''
-            Simulate cycling appliances, eg. fridges and freezers based on
-            average clycle length
-            '''
+    def __init__(self, dataset):
+        # the prototypes are sorted by name for a fixed order of the table
+        self.names = sorted(dataset.keys())
+        self.equipment = dict()
+        for name in self.names:
+            self.equipment.update({name: Equipment(**dataset[name]).freeze()})
+        # and the structured array with a row for each prototype
+        table = np.hstack([self.equipment[name].record(name) for name in self.names])
+        table.setflags(write=False)
+        self.table = table
+        self.index = dict((name, i) for i, name in enumerate(self.names))
 
-            nbin = nday * 24 * 60
-            P = np.zeros(nbin + 1)
-            Q = np.zeros(nbin + 1)
-            n_eq = 0
-            left = random.gauss(self.delay, self.delay / 4)
-            for tl in range(nbin + 1):
-                if left <= 0:
-                    n_eq += 1
-                    left += self.cycle_length
-                    P[tl] = self.cycle_power
-                else:
-                    left += -1
-                    P[tl] = self.standby_power
+    def __getitem__(self, name):
+        return self.equipment[name]
 
-            r_eq = {'time': time, 'occ': None, 'P': P, 'Q': Q, 'QRad': P * self.frad,
-                    'QCon': P * self.fconv, 'Wknds': None, 'mDHW': None}
+    def __contains__(self, name):
+        return name in self.equipment
 
-            return r_eq, n_eq
+    def rows(self, names):
+        '''
+        Get the rows of the structured array for the given names.
+        '''
+        return self.table[[self.index[name] for name in names]]
 
-        if self.type == 'appliance':
-            # check if the equipment is an appliance instead of tapping point
-            if self.delay == 0:
-                r_app, n_app = stochastic_load(self, nday, dow, cluster, occ)
-            else:
-                r_app, n_app = cycle_load(self, nday)
-        else:
-            r_app, n_app = stochastic_flow(self, nday, dow, cluster, occ)
 
-        return r_app, n_app
+_CATALOG = dict()
+_LOCK = threading.Lock()
+
+def get_catalog():
+    '''
+    Get the appliance Catalog, which is built only once per process.
+    '''
+    with _LOCK:
+        if not _CATALOG:
+            _CATALOG.update({'catalog': Catalog(data.get_appliances())})
+    return _CATALOG['catalog']
@@ -5,11 +5,43 @@ Created on Wed Oct 09 11:57:02 2013
 @author: Ruben Baetens
 """
 
+import os
+import threading
+
 import numpy as np
-import random
 
 import data
 
+##############################################################################
+# Days of occupancy are drawn by rejection sampling against the checks of the
+# household model, drawing a single day for each chain first and a batch of
+# candidate days for each rejected chain thereafter, for a bounded number of
+# attempts, for which the counter keeps track of the number of drawn and
+# accepted candidates of all threads.
+CANDIDATES = 4
+ATTEMPTS = 25
+_ACCEPTANCE = {'drawn': 0, 'accepted': 0}
+_LOCK = threading.Lock()
+
+##############################################################################
+# Cumulative distributions read from the datasets are only renormalized if
+# they end at 1 within this tolerance, and rejected otherwise.
+CDF_TOLERANCE = 1e-6
+
+def get_rng(seed, *key):
+    '''
+    Get the independent random number generator of the stream 'key', e.g.
+    the household index followed by the appliance index, being a RandomState
+    seeded by 'seed' and all integers of the key, such that only identical
+    keys share a stream.
+    '''
+    return np.random.RandomState([int(seed)] + [int(k) for k in key])
+
+def new_seed():
+    '''
+    Get a new random seed from the operating system.
+    '''
+    return int(np.frombuffer(os.urandom(4), dtype=np.uint32)[0])
 
 def get_probability(rnd, prob, p_type='cum'):
     '''
@@ -19,10 +51,44 @@ def get_probability(rnd, prob, p_type='cum'):
     if p_type != 'cum':
         prob = np.cumsum(prob)
         prob /= max(prob)
-    idx = 1
-    while rnd >= prob[idx-1]:
-        idx += 1
-    return idx
+    return int(get_probabilities(rnd, prob))
+
+def get_probabilities(rnd, prob):
+    '''
+    Find the x-values in the given comulative probabilities 'prob' for an
+    array of random y-values 'rnd' at once. Either a single distribution is
+    given for all values in 'rnd', or 'prob' holds a distribution on each
+    row for every value in 'rnd' (e.g. one for each chain), returning the
+    1-based indices as does get_probability().
+    '''
+    rnd = np.asarray(rnd)
+    prob = np.asarray(prob)
+    if prob.ndim == 1:
+        return np.searchsorted(prob, rnd, side='right') + 1
+    # the position of each value in its own row equals the number of
+    # entries in the row not exceeding it
+    return np.sum(prob <= rnd[..., None], axis=-1) + 1
+
+def get_cdf(prob, name='', p_type='cum'):
+    '''
+    Validate and normalize the (comulative) probabilities 'prob' along the
+    last axis to a monotone cumulative distribution ending at exactly 1, as
+    to sample from by lookups only. A ValueError is raised for malformed
+    distributions in the table 'name', being cumulative distributions that
+    exceed 1 or do not end at 1 within CDF_TOLERANCE.
+    '''
+    prob = np.array(prob, dtype=float)
+    if not np.all(np.isfinite(prob)) or np.any(prob < 0):
+        raise ValueError('Distribution %s holds invalid probabilities' % name)
+    if p_type != 'cum':
+        prob = np.cumsum(prob, axis=-1)
+    elif np.any(np.diff(prob, axis=-1) < 0):
+        raise ValueError('Distribution %s is not monotone' % name)
+    elif np.any(prob > 1 + CDF_TOLERANCE) or np.any(abs(prob[..., -1] - 1) > CDF_TOLERANCE):
+        raise ValueError('Distribution %s does not end at 1' % name)
+    if np.any(prob[..., -1] <= 0):
+        raise ValueError('Distribution %s holds no probability' % name)
+    return prob / prob[..., -1:]
 
 def sum_dict(dict_a, dict_b):
     '''
@@ -45,49 +111,248 @@ def sum_dict(dict_a, dict_b):
     # and return
     return sum_dict
 
+def rle(chains):
+    '''
+    Run-length encoding of the chains along the last axis of 'chains', of
+    which runs never continue from one chain into the next, returning the
+    flat indices of the starts of all runs in the raveled chains, and their
+    lengths and values.
+    '''
+    chains = np.asarray(chains)
+    flat = chains.ravel()
+    # a run starts at each change of value and at the start of each chain
+    new = np.ones(len(flat), dtype=bool)
+    new[1:] = flat[1:] != flat[:-1]
+    new[::chains.shape[-1]] = True
+    starts = np.nonzero(new)[0]
+    lengths = np.diff(np.append(starts, len(flat)))
+    return starts, lengths, flat[starts]
+
+def rld(lengths, values, shape=None):
+    '''
+    Run-length decoding of the runs of given 'lengths' and 'values' into a
+    chain, or into chains of the given shape.
+    '''
+    chains = np.repeat(values, lengths)
+    return chains if shape is None else chains.reshape(shape)
+
+def startstates(clusters, rng=np.random):
+    '''
+    Draw the start states at 4:00 AM for chains following the patterns
+    'clusters' at once.
+    '''
+    clu = np.asarray(clusters, dtype=int) - 1
+    rnd = rng.uniform(size=len(clu))
+    return get_probabilities(rnd, data.get_occupancy_tables()['ss'][clu])
+
+def simulate_days(start, clusters, rng=np.random):
+    '''
+    Simulate a day of 144 ten-minute steps for M independent chains at once
+    by Monte Carlo Survival Analysis as does MCSA, starting from the states
+    'start' and following the patterns 'clusters' given for each chain, and
+    return the occupancy states as an array of shape (M x 144).
+    '''
+    tables = data.get_occupancy_tables()
+    start = np.asarray(start, dtype=int)
+    # the state, remaining duration and pattern of each chain, for which
+    # the arrays are advanced in lockstep with the timebins
+    clu = np.asarray(clusters, dtype=int) - 1
+    occs = np.zeros((len(start), 144), dtype=int)
+    occs[:, 0] = start
+    t48 = np.repeat(np.arange(48), 3)
+    rnd = rng.uniform(size=len(start))
+    dt = get_probabilities(rnd, tables['ol'][clu, start - 1, t48[0]])
+    for tbin in range(1, 144):
+        # chains of which the state ended get a new state and duration,
+        # where -1 is necessary as the occupancy state already started
+        ended = np.nonzero(dt == 0)[0]
+        dt -= 1
+        occs[:, tbin] = occs[:, tbin - 1]
+        if len(ended) != 0:
+            rnd = rng.uniform(size=len(ended))
+            probs = tables['os'][clu[ended], occs[ended, tbin - 1] - 1, t48[tbin]]
+            occs[ended, tbin] = get_probabilities(rnd, probs)
+            rnd = rng.uniform(size=len(ended))
+            probs = tables['ol'][clu[ended], occs[ended, tbin] - 1, t48[tbin]]
+            dt[ended] = get_probabilities(rnd, probs) - 1
+    return occs
+
+def sample_days(start, clusters, check, rng=np.random, candidates=CANDIDATES,
+                attempts=ATTEMPTS):
+    '''
+    Simulate a day for each of the chains as does simulate_days, yet reject
+    days for which 'check' (returning a boolean for each of a batch of days)
+    is False by drawing 'candidates' days per rejected chain at once and
+    keeping the first day accepted, for at most 'attempts' batches after
+    which the last candidate of a chain is kept regardless.
+    '''
+    start = np.asarray(start, dtype=int)
+    clusters = np.asarray(clusters, dtype=int)
+    occs = np.zeros((len(start), 144), dtype=int)
+    todo = np.arange(len(start))
+    for attempt in range(attempts):
+        if len(todo) == 0:
+            break
+        # a single day is drawn for each chain first, as most are accepted
+        k = 1 if attempt == 0 else candidates
+        cand = simulate_days(np.repeat(start[todo], k), np.repeat(clusters[todo], k), rng)
+        cand = cand.reshape(len(todo), k, 144)
+        accept = np.reshape(check(cand.reshape(-1, 144)), (len(todo), k))
+        with _LOCK:
+            _ACCEPTANCE['drawn'] += accept.size
+            _ACCEPTANCE['accepted'] += int(np.sum(accept))
+        # keep the first accepted or otherwise the last candidate
+        first = np.where(accept.any(axis=1), np.argmax(accept, axis=1), k - 1)
+        occs[todo] = cand[np.arange(len(todo)), first]
+        todo = todo[~accept.any(axis=1)]
+    return occs
+
+def acceptance_info(reset=False):
+    '''
+    Report the number of drawn and accepted candidate days of sample_days
+    and their acceptance rate, and reset the counter if asked.
+    '''
+    with _LOCK:
+        info = dict(_ACCEPTANCE)
+        if reset:
+            _ACCEPTANCE.update({'drawn': 0, 'accepted': 0})
+    info.update({'rate': info['accepted'] / float(max(1, info['drawn']))})
+    return info
+
+def switch_events(rnd, prob, length, spread, rng=np.random):
+    '''
+    Find the switch-on events of a stochastic appliance for the given
+    uniforms 'rnd' and switch-on probabilities 'prob' of each minute, where
+    each event lasts a normal number of minutes (mean 'length', deviation
+    'spread') during which the appliance is busy and cannot be switched on.
+    Return the minutes at which the events start and their on-minutes, being
+    max(0, ceil(duration)), after which the next switch-on is allowed only
+    from the minute after.
+    '''
+    return skip_events(np.nonzero(rnd < prob)[0], length, spread, rng)
+
+def skip_events(cand, length, spread, rng=np.random):
+    '''
+    Find the switch-on events as does switch_events from the sorted minutes
+    'cand' at which a switch-on would occur if the appliance is not busy.
+    '''
+    # we skip the candidates within the dead-time of each event found
+    starts = []
+    n_on = []
+    i = 0
+    while i < len(cand):
+        start = cand[i]
+        n = max(0, int(np.ceil(rng.normal(length, spread))))
+        starts.append(start)
+        n_on.append(n)
+        i += np.searchsorted(cand[i:], start + n + 1)
+    return np.array(starts, dtype=int), np.array(n_on, dtype=int)
+
+def cycle_events(delay, length, minutes):
+    '''
+    Find the minutes within 'minutes' + 1 minutes at which a cycling
+    appliance is switched on for a minute after a 'delay', each time its
+    cycle of 'length' minutes has passed, i.e. the k-th time at the first
+    minute from which delay + (length + 1) * k minutes have passed, yet at
+    most once every minute.
+    '''
+    n_eq = max(0, min(minutes, int(np.floor((minutes - delay) / (length + 1)))) + 1)
+    k = np.arange(n_eq)
+    return np.maximum(k, np.ceil(delay + (length + 1) * k)).astype(int)
+
+class Alias(object):
+    '''
+    The Alias class defines a Walker alias table of a fixed discrete
+    distribution, built once for drawing values in constant time.
+    '''
+    # All object parameters are given in kwargs
+    def __init__(self, prob, p_type='prob', **kwargs):
+        # get the validated probabilities of the distribution
+        cdf = get_cdf(prob, p_type=p_type)
+        prob = np.diff(np.hstack((0, cdf))) * len(cdf)
+        # and fill the table by pairing each small with a large probability,
+        # following the method of Vose (1991)
+        self.prob = np.ones(len(prob))
+        self.alias = np.arange(len(prob))
+        small = [i for i in range(len(prob)) if prob[i] < 1]
+        large = [i for i in range(len(prob)) if prob[i] >= 1]
+        while small and large:
+            i = small.pop()
+            j = large.pop()
+            self.prob[i] = prob[i]
+            self.alias[i] = j
+            prob[j] += prob[i] - 1
+            if prob[j] < 1:
+                small.append(j)
+            else:
+                large.append(j)
+
+    def draw(self, n=None, rng=np.random):
+        '''
+        Draw a single value or an array of n values from the distribution,
+        given as 1-based indices as does get_probability().
+        '''
+        # a single random number picks both the column and the coin flip
+        rnd = np.asarray(rng.uniform(size=n)) * len(self.prob)
+        col = np.minimum(rnd.astype(int), len(self.prob) - 1)
+        idx = np.where(rnd - col < self.prob[col], col, self.alias[col]) + 1
+        return int(idx) if n is None else idx
+
+
 class MCSA(object):
     '''
-    The MCSA class defines a Monte Carlo Survival Analysis
+    The MCSA class defines a Monte Carlo Survival Analysis, of which the
+    cumulative distributions are held as dense arrays of start states OSS
+    (3), transitions OPM (3x48x3) and durations ODM (3x48x144), indexed by
+    the 1-based state and timebin minus one.
     '''
     # All object parameters are given in kwargs
     def __init__(self, cluster, **kwargs):
         # load the dataset of the cluster into ds
-        ds = data.get_occDict(cluster)
+        ds = data.get_occupancy(cluster)
         # and add them as class parameters
         self.OSS = ds['ss']
-        self.OPM = {1:ds['os_1'], 2:ds['os_2'], 3:ds['os_3']}
-        self.ODM = {1:ds['ol_1'], 2:ds['ol_2'], 3:ds['ol_3']}
-#        self.RED = ds['RED']
+        self.OPM = ds['os']
+        self.ODM = ds['ol']
+        # with the random number generator to draw from
+        self.rng = kwargs.get('rng', np.random)
+
+    def _draw(self, probs):
+        '''
+        Draw from the cumulative distributions on the last axis of probs, by a
+        single random number or an array of random numbers.
+        '''
+        if probs.ndim == 1:
+            return int(get_probabilities(self.rng.uniform(), probs))
+        return get_probabilities(self.rng.uniform(size=probs.shape[:-1]), probs)
 
-    def startstate(self):
+    def startstate(self, n=None):
         '''
-        Get the startstate for first simulation day at 4:00 AM.
+        Get the startstate for first simulation day at 4:00 AM, or an array
+        of n startstates.
         '''
         # we define the startstate based on the given probability
-        probs = [self.OSS['1'], self.OSS['2'], self.OSS['3']]
-        state = get_probability(random.random(), probs)
-        # and retrun the value
-        return int(state)
+        if n is None:
+            return self._draw(self.OSS)
+        return self._draw(np.tile(self.OSS, (n, 1)))
     
     def transition(self, state, timebin):
         '''
-        Get next occupancy state from current state ending at time.
+        Get next occupancy state from current state ending at time, for a
+        single or an array of states and timebins.
         '''
         # we define the new state based on the given probability
-        probs = self.OPM[state][str(timebin)]
-        newoc = get_probability(random.random(), probs)
-        # and retrun the value
-        return int(newoc)
+        state, timebin = np.broadcast_arrays(state, timebin)
+        return self._draw(self.OPM[state - 1, timebin - 1])
     
     def duration(self, state, timebin):
         '''
-        Get the duration of current state started at time.
+        Get the duration of current state started at time, for a single or an
+        array of states and timebins.
         '''
         # we define the new duration based on the given probability
-        probs = self.ODM[state][str(timebin)]
-        durat = get_probability(random.random(), probs)
-        # and retrun the value
-        return durat
+        state, timebin = np.broadcast_arrays(state, timebin)
+        return self._draw(self.ODM[state - 1, timebin - 1])
 
 
 class DTMC(object):
@@ -96,13 +361,24 @@ class DTMC(object):
     '''
     # All object parameters are given in kwargs
     def __init__(self, clusterDict, **kwargs):
-        # load the dataset of the cluster into ds
-        self.ds = dict()
-        for i in range(5):
-            self.ds.update({i:data.get_actDict(clusterDict['wkdy'])})
-        self.ds.update({5:data.get_actDict(clusterDict['son'])})
-        self.ds.update({6:data.get_actDict(clusterDict['son'])})
+        # load the shared dataset (7x10x144) of the clusters into ds, being
+        # the weekday cluster for monday till friday, and the saturday and
+        # sunday clusters for day 5 and 6
+        self.ds = data.get_activity_tensor(clusterDict['wkdy'],
+                                           clusterDict['sat'],
+                                           clusterDict['son'])
+        self.acts = dict((act, i) for i, act in enumerate(data.ACTIVITIES))
     def get_var(self, dow, act, step):
         # get the probability of the given activity for daytype dow at step
-        return self.ds[dow][act][step]
+        return self.ds[dow, self.acts[act], step]
+    def get_grid(self, dow, occ, acts=None):
+        # get the probability of each activity, or of the given activities
+        # only, and of 'Presence' at each step of the days dow, being zero
+        # if not present as given by occ
+        presence = np.asarray(occ[:len(dow) * 144]) == 1
+        dow = np.asarray(dow)
+        grid = {'Presence': presence}
+        for act in self.acts if acts is None else set(acts) & set(self.acts):
+            grid.update({act: presence * self.ds[dow, self.acts[act]].ravel()})
+        return grid
 
@@ -9,6 +9,7 @@ from multiprocessing import Pool
 
 import pandas as pd
 
+import Corpus.data
 import Corpus.feeder
 
 
@@ -83,7 +84,7 @@ def makeStrobe(data):
     if not os.path.isdir(path):
         os.mkdir(path)
     Corpus.feeder.IDEAS_cluster(bui_names=types, bui_numbers=numbers, sample_time=900, path=path, filter=True,
-                                test=False, extra_name=name)
+                                test=False, extra_name=name, seed=data['seed'], index=data['index'])
 
 
 def collecttxt(target, source=None):
@@ -131,6 +132,8 @@ if __name__ == '__main__':
     # Where results of this file are saved (keep the Example/GenkNET structure, but change the rest accordingly)
     target = 'C:/Users/u0094934/Documents/Dymola/GenkNET/UserData'
     # Where the results should go (direct to subdirectory UserData of your GenkNET clone)
+    seed = 2013
+    # Seed of all random streams, such that results are reproducible for any number of processes
 
     ############################
     ##     CODE FROM HERE     ##
@@ -147,13 +150,15 @@ if __name__ == '__main__':
 
     inputs = []
 
-    for name in names:
+    for index, name in enumerate(names):
         data = OrderedDict()
         for type in ['D', 'SD', 'T']:
             nametype, number = getNumbers(data=neighbdata, neighbname=name, buiType=type)
             data[type] = number
         data['name'] = name
         data['home'] = homefolder
+        data['seed'] = seed
+        data['index'] = (index,)
         inputs.append(data)
         print("{: >20} {: >20} {: >20}".format(name, nametype, number))
 
@@ -164,6 +169,9 @@ if __name__ == '__main__':
     print inputs
 
     if multi:
+        # compile the data bundle once, such that all workers map the same
+        # read-only tables instead of each compiling their own copy
+        Corpus.data.get_bundle()
         po = Pool(processes=proc)
         po.map(makeStrobe, inputs)
     else: